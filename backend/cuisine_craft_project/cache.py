@@ -0,0 +1,267 @@
+"""
+Shared cache layer.
+
+When REDIS_URL is set, settings.CACHES points 'default' at TieredCache: a
+small per-process LocMemCache (L1, a few seconds TTL) in front of Django's
+RedisCache (L2), which keeps a connection pool per server. Values written to
+Redis go through CompressedSerializer, so large entries such as serialized
+recommendation responses are zlib-compressed on the wire and in memory.
+
+Any server that speaks the Redis protocol works as L2, e.g. a local
+redis-server or fakeredis.TcpFakeServer for development.
+
+get_or_compute() wraps expensive cache fills with single-flight and
+stale-while-revalidate semantics on top of whichever cache is configured.
+"""
+import logging
+import pickle
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from django.core.cache import caches, cache as default_cache
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisSerializer
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Pickles smaller than this aren't worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+# Prefix marking a zlib-compressed pickle (plain pickles start with 0x80)
+COMPRESSED_MARKER = b'z'
+
+
+class CompressedSerializer(RedisSerializer):
+    """Pickle values and zlib-compress the large ones; ints stay raw so INCR works"""
+
+    def dumps(self, obj):
+        if type(obj) is int:
+            return obj
+        data = pickle.dumps(obj, self.protocol)
+        if len(data) >= COMPRESS_MIN_BYTES:
+            return COMPRESSED_MARKER + zlib.compress(data, 1)
+        return data
+
+    def loads(self, data):
+        if data[:1] == COMPRESSED_MARKER:
+            return pickle.loads(zlib.decompress(data[1:]))
+        return super().loads(data)
+
+
+class TieredCache(BaseCache):
+    """
+    Per-process L1 in front of a shared cache alias.
+
+    Reads are served from L1 when possible and otherwise filled from the
+    shared cache. Writes go to both. Another process's writes become visible
+    here once the L1 copy expires, so LOCAL_TIMEOUT bounds how stale a read
+    can be; this process's own writes are visible immediately.
+
+    OPTIONS:
+        SHARED: alias of the shared cache (default 'shared')
+        LOCAL_TIMEOUT: L1 TTL in seconds (default 5)
+        LOCAL_MAX_ENTRIES: L1 size (default 1000)
+    """
+
+    def __init__(self, location, params):
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED', 'shared')
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        super().__init__({k: v for k, v in params.items() if k != 'OPTIONS'})
+        self._local = LocMemCache(
+            f'tiered-l1-{location or self._shared_alias}',
+            {
+                'TIMEOUT': self._local_timeout,
+                'OPTIONS': {'MAX_ENTRIES': options.get('LOCAL_MAX_ENTRIES', 1000)},
+            },
+        )
+
+    @property
+    def _shared(self):
+        return caches[self._shared_alias]
+
+    def _local_ttl(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return self._local_timeout
+        return min(timeout, self._local_timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self._shared.add(key, value, timeout, version)
+        if added:
+            self._local.set(key, value, self._local_ttl(timeout), version)
+        return added
+
+    def get(self, key, default=None, version=None):
+        value = self._local.get(key, self._missing_key, version)
+        if value is not self._missing_key:
+            return value
+        value = self._shared.get(key, self._missing_key, version)
+        if value is self._missing_key:
+            return default
+        self._local.set(key, value, self._local_timeout, version)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._shared.set(key, value, timeout, version)
+        self._local.set(key, value, self._local_ttl(timeout), version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._local.delete(key, version)
+        return self._shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self._local.delete(key, version)
+        return self._shared.delete(key, version)
+
+    def get_many(self, keys, version=None):
+        found = self._local.get_many(keys, version)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            fetched = self._shared.get_many(missing, version)
+            self._local.set_many(fetched, self._local_timeout, version)
+            found.update(fetched)
+        return found
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self._shared.set_many(data, timeout, version)
+        self._local.set_many(data, self._local_ttl(timeout), version)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        self._local.delete_many(keys, version)
+        self._shared.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        return self._local.has_key(key, version) or self._shared.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        self._local.delete(key, version)
+        return self._shared.incr(key, delta, version)
+
+    def clear(self):
+        self._local.clear()
+        self._shared.clear()
+
+    def close(self, **kwargs):
+        self._shared.close(**kwargs)
+
+
+# Cached values wrapped with the time after which they count as stale
+CachedValue = namedtuple('CachedValue', ['value', 'fresh_until'])
+
+# What a get_or_compute() compute function returns to cache its value for
+# at most timeout seconds and never serve it stale (e.g. a degraded result
+# that a recomputation should replace soon)
+ShortLived = namedtuple('ShortLived', ['value', 'timeout'])
+
+# How long one computation may run before waiters stop waiting for it
+COMPUTE_LOCK_TIMEOUT = 30
+
+# How often waiters in other processes check whether the value has landed
+WAIT_POLL_INTERVAL = 0.05
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def get_or_compute(key, compute, timeout, stale_timeout=0, cache=None):
+    """
+    Return the cached value for key, calling compute() to fill it on a miss.
+
+    Single flight: while one caller computes a key, other callers of the same
+    key wait for its result instead of computing it again (threads in this
+    process wait on an event; other processes poll the cache while a lock
+    entry taken with cache.add exists).
+
+    Stale-while-revalidate: a value is fresh for timeout seconds and then
+    served stale for up to stale_timeout more while one background thread
+    recomputes it. compute() can return ShortLived to shorten both.
+    """
+    cache = cache or default_cache
+    entry = cache.get(key)
+    if isinstance(entry, CachedValue):
+        if time.time() >= entry.fresh_until:
+            _refresh_in_background(key, compute, timeout, stale_timeout, cache)
+        return entry.value
+    return _compute_once(key, compute, timeout, stale_timeout, cache)
+
+
+def _store(key, value, timeout, stale_timeout, cache):
+    if isinstance(value, ShortLived):
+        value, timeout, stale_timeout = value.value, min(timeout, value.timeout), 0
+    cache.set(key, CachedValue(value, time.time() + timeout), timeout + stale_timeout)
+    return value
+
+
+def _compute_once(key, compute, timeout, stale_timeout, cache):
+    with _inflight_lock:
+        done = _inflight.get(key)
+        leader = done is None
+        if leader:
+            done = _inflight[key] = threading.Event()
+
+    if not leader:
+        done.wait(COMPUTE_LOCK_TIMEOUT)
+        entry = cache.get(key)
+        if isinstance(entry, CachedValue):
+            return entry.value
+        # The computation failed or timed out; do it ourselves
+        return _store(key, compute(), timeout, stale_timeout, cache)
+
+    lock_key = f'{key}:computing'
+    try:
+        locked = cache.add(lock_key, 1, COMPUTE_LOCK_TIMEOUT)
+        if locked:
+            # Another process may have stored it between our miss and the lock
+            entry = cache.get(key)
+        else:
+            entry = _wait_for_other_process(key, lock_key, cache)
+        if isinstance(entry, CachedValue):
+            if locked:
+                cache.delete(lock_key)
+            return entry.value
+        try:
+            return _store(key, compute(), timeout, stale_timeout, cache)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        done.set()
+
+
+def _wait_for_other_process(key, lock_key, cache):
+    deadline = time.monotonic() + COMPUTE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        entry = cache.get(key)
+        if isinstance(entry, CachedValue):
+            return entry
+        if not cache.has_key(lock_key):
+            break
+        time.sleep(WAIT_POLL_INTERVAL)
+    return None
+
+
+def _refresh_in_background(key, compute, timeout, stale_timeout, cache):
+    lock_key = f'{key}:computing'
+    if not cache.add(lock_key, 1, COMPUTE_LOCK_TIMEOUT):
+        # Already being refreshed
+        return
+
+    def refresh():
+        try:
+            _store(key, compute(), timeout, stale_timeout, cache)
+        except Exception:
+            logger.exception('Background refresh of %s failed', key)
+        finally:
+            cache.delete(lock_key)
+            connections.close_all()
+
+    threading.Thread(target=refresh, daemon=True).start()
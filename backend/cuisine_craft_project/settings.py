@@ -103,6 +103,40 @@ DATABASES = {
     )
 }
 
+# Cache
+# Set REDIS_URL to share one cache between all workers (see cuisine_craft_project/cache.py);
+# otherwise each process keeps its own in-memory cache
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'cuisine_craft_project.cache.TieredCache',
+            'OPTIONS': {
+                'SHARED': 'shared',
+                'LOCAL_TIMEOUT': int(os.environ.get('CACHE_LOCAL_TIMEOUT', 5)),
+            },
+        },
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'cuisinecraft',
+            'OPTIONS': {
+                'serializer': 'cuisine_craft_project.cache.CompressedSerializer',
+                'max_connections': int(os.environ.get('REDIS_MAX_CONNECTIONS', 20)),
+                'socket_connect_timeout': 2,
+                'socket_timeout': 2,
+                'health_check_interval': 30,
+            },
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -149,6 +183,21 @@ MEDIA_URL = '/media/'
 # Use the env var if provided (for persistent disk on Render)
 MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
 
+# Precomputed recommendation artifacts (TF-IDF matrix, neighbour tables)
+RECOMMENDATION_ARTIFACTS_DIR = os.environ.get(
+    'RECOMMENDATION_ARTIFACTS_DIR', os.path.join(BASE_DIR, 'recommendation_artifacts')
+)
+
+# Inverted lists searched, and approximate matches re-scored exactly, per
+# query by the optional ANN index; more is slower but finds more of the true
+# neighbours (see benchmark_ann)
+RECOMMENDATION_ANN_PROBES = int(os.environ.get('RECOMMENDATION_ANN_PROBES', 8))
+RECOMMENDATION_ANN_CANDIDATES = int(os.environ.get('RECOMMENDATION_ANN_CANDIDATES', 100))
+
+# Seconds personalized recommendations wait for their candidate generators;
+# generators still running after that are left out (see recommendations/pipeline.py)
+RECOMMENDATION_PIPELINE_BUDGET = float(os.environ.get('RECOMMENDATION_PIPELINE_BUDGET', 0.25))
+
 # React app build folder
 REACT_APP_DIR = os.path.join(BASE_DIR, '..', 'frontend', 'build')
 
@@ -0,0 +1,61 @@
+"""
+Work deferred to the end of the current transaction.
+
+CommitBatch collects items (recipe ids, say) from signal handlers and hands
+all of them to one callback once the transaction commits, so a transaction
+that touches many rows does the follow-up work once rather than per row.
+
+The collected items belong to the transaction's on_commit callback: if the
+transaction rolls back, Django discards the callback and the items with it,
+and the next add() starts a new batch. A rolled back savepoint only discards
+the batch when the callback was registered inside it; items added inside it
+to an older batch stay queued, which at worst redoes some work for rows that
+did not change.
+"""
+import threading
+
+from django.db import transaction
+
+
+class _Batch:
+    def __init__(self, owner):
+        self.owner = owner
+        self.items = set()
+        self.hooks = None
+
+    def queued(self, connection):
+        """Whether this batch's callback will still run when the transaction commits"""
+        # Commits and rollbacks replace the connection's hook list, and a
+        # savepoint rollback replaces it with the hooks that survived
+        if connection.run_on_commit is self.hooks:
+            return True
+        if any(hook[1] is self for hook in connection.run_on_commit):
+            self.hooks = connection.run_on_commit
+            return True
+        return False
+
+    def __call__(self):
+        if getattr(self.owner._local, 'batch', None) is self:
+            self.owner._local.batch = None
+        self.owner.apply(self.items)
+
+
+class CommitBatch:
+    """Collects items over a transaction and passes them to apply(items) once it commits"""
+
+    def __init__(self, apply):
+        self.apply = apply
+        self._local = threading.local()
+
+    def add(self, *items):
+        """Queue items for the current transaction (applied at once outside one)"""
+        connection = transaction.get_connection()
+        batch = getattr(self._local, 'batch', None)
+        if batch is not None and batch.queued(connection):
+            batch.items.update(items)
+            return
+        batch = self._local.batch = _Batch(self)
+        batch.items.update(items)
+        batch.hooks = connection.run_on_commit
+        # Runs the batch straight away in autocommit mode
+        transaction.on_commit(batch)
@@ -21,14 +21,17 @@ def import_data():
     print("Checking if recipes already exist...")
     if check_if_recipes_exist():
         print("Recipes already exist in the database. Skipping import.")
-        return
-        
-    print("Importing recipes from TheMealDB API...")
-    call_command('import_recipes')
-    
-    print("Adding dietary tags to recipes...")
-    call_command('add_dietary_tags')
-    
+    else:
+        print("Importing recipes from TheMealDB API...")
+        # Recipes are tagged as their ingredients are saved
+        call_command('import_recipes')
+
+    print("Building recommendation index...")
+    call_command('build_recommendation_index')
+
+    print("Refreshing recipe popularity...")
+    call_command('refresh_popularity')
+
     print("Data import completed successfully!")
 
 if __name__ == "__main__":
@@ -4,11 +4,33 @@ from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from .models import Recipe, SavedRecipe, RecipeIngredient
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
-from recommendations.models import RecipeInteraction, DietaryPreference
+from django.db.models import Q, Prefetch, prefetch_related_objects
+from django.db.models.manager import BaseManager
+from recommendations.models import DietaryPreference
+from recommendations.interactions import record_interaction
 from rest_framework import serializers
 from recommendations.recommendation_engine import filter_by_dietary_preferences
 from recommendations.text_utils import search_by_ingredients
+from recommendations.indexes import dietary_index
+from .pagination import RecipeCursorPagination, RecipeSearchCursorPagination, RankedSearchPagination
+from .search import RankedSearch, ranked_recipes
+
+def prefetch_recipe_ingredients(recipes):
+    """Load the ingredients of all given recipes in a single query"""
+    prefetch_related_objects(recipes, Prefetch(
+        'recipe_ingredients',
+        queryset=RecipeIngredient.objects.select_related('ingredient'),
+    ))
+    return recipes
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """Batch-loads what RecipeSerializer needs so a list costs a fixed number of queries"""
+    
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, BaseManager) else data)
+        prefetch_recipe_ingredients(recipes)
+        self.child.saved_recipe_ids()
+        return super().to_representation(recipes)
 
 class RecipeSerializer(serializers.ModelSerializer):
     isFavorite = serializers.SerializerMethodField()
@@ -17,12 +39,22 @@ class RecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
         fields = ['recipe_id', 'title', 'instructions', 'dietary_tags', 'image_url', 'isFavorite', 'ingredients']
+        list_serializer_class = RecipeListSerializer
+    
+    def saved_recipe_ids(self):
+        """Ids of the requesting user's saved recipes, loaded once per serializer context"""
+        if 'saved_recipe_ids' not in self.context:
+            request = self.context.get('request')
+            if request and request.user.is_authenticated:
+                self.context['saved_recipe_ids'] = set(
+                    SavedRecipe.objects.filter(user=request.user).values_list('recipe_id', flat=True)
+                )
+            else:
+                self.context['saved_recipe_ids'] = set()
+        return self.context['saved_recipe_ids']
     
     def get_isFavorite(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return SavedRecipe.objects.filter(user=request.user, recipe=obj).exists()
-        return False
+        return obj.recipe_id in self.saved_recipe_ids()
         
     def get_ingredients(self, obj):
         ingredients = []
@@ -33,8 +65,15 @@ class RecipeSerializer(serializers.ModelSerializer):
             })
         return ingredients
 
+def paginated_recipes_response(view, request, recipes, pagination_class):
+    """Serialize one keyset page of recipes, with next/previous cursors"""
+    paginator = pagination_class()
+    page = paginator.paginate_queryset(recipes, request, view=view)
+    serializer = RecipeSerializer(page, many=True, context={'request': request})
+    return paginator.get_paginated_response(serializer.data)
+
 class RecipeListView(APIView):
-    """Get all recipes"""
+    """Get all recipes (one page at a time when a cursor or page_size is given)"""
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
@@ -50,6 +89,9 @@ class RecipeListView(APIView):
         if preferences:
             recipes = filter_by_dietary_preferences(recipes, preferences)
         
+        if RecipeCursorPagination.requested(request):
+            return paginated_recipes_response(self, request, recipes, RecipeCursorPagination)
+        
         serializer = RecipeSerializer(recipes, many=True, context={'request': request})
         return Response(serializer.data)
 
@@ -61,12 +103,9 @@ class RecipeDetailView(APIView):
         recipe = get_object_or_404(Recipe, pk=recipe_id)
         
         # Record view interaction
-        RecipeInteraction.objects.create(
-            user=request.user,
-            recipe=recipe,
-            interaction_type='view'
-        )
+        record_interaction(request.user, recipe, 'view')
         
+        prefetch_recipe_ingredients([recipe])
         serializer = RecipeSerializer(recipe, context={'request': request})
         return Response(serializer.data)
 
@@ -88,11 +127,7 @@ class ToggleFavoriteView(APIView):
             is_favorite = True
             
             # Record favorite interaction
-            RecipeInteraction.objects.create(
-                user=request.user,
-                recipe=recipe,
-                interaction_type='favorite'
-            )
+            record_interaction(request.user, recipe, 'favorite')
         
         return Response({'isFavorite': is_favorite})
 
@@ -108,22 +143,20 @@ class FavoriteRecipesView(APIView):
         return Response(serializer.data)
 
 class RecipeSearchView(APIView):
-    """Search for recipes"""
+    """Search for recipes (one page at a time when a cursor or page_size is given)"""
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
         query = request.GET.get('query', '')
         ingredients = request.GET.get('ingredients', '')
+        paginated = RecipeSearchCursorPagination.requested(request)
         
         if ingredients:
             # Use the search_by_ingredients function from text_utils
-            recipes = search_by_ingredients(ingredients, user=request.user)
+            # (the page size replaces its default limit when paginating)
+            recipes = search_by_ingredients(ingredients, limit=None if paginated else 20, user=request.user)
         elif query:
-            recipes = Recipe.objects.filter(
-                Q(title__icontains=query) |
-                Q(instructions__icontains=query) |
-                Q(dietary_tags__contains=[query])
-            ).distinct()
+            return self._ranked_search_response(request, query, paginated)
         else:
             recipes = Recipe.objects.all()  # Don't limit here, wait until after filtering
         
@@ -138,12 +171,40 @@ class RecipeSearchView(APIView):
             if preferences:
                 recipes = filter_by_dietary_preferences(recipes, preferences)
         
+        if paginated:
+            return paginated_recipes_response(self, request, recipes, RecipeSearchCursorPagination)
+        
         # Limit results after filtering
-        if not query and not ingredients:
+        if not ingredients:
             recipes = recipes[:10]
             
         serializer = RecipeSerializer(recipes, many=True, context={'request': request})
         return Response(serializer.data)
+    
+    def _ranked_search_response(self, request, query, paginated):
+        """Full-text matches in relevance order, then recipes tagged with the query"""
+        preferences = list(DietaryPreference.objects.filter(
+            user=request.user
+        ).values_list('restriction_type', flat=True))
+        search = RankedSearch(
+            query,
+            tagged_ids=dietary_index.recipe_ids_matching([query]),
+            allowed_ids=dietary_index.recipe_ids_matching(preferences) if preferences else None
+        )
+        
+        # Only the requested page of ranked ids is read from the search index;
+        # unpaginated requests get every match, as they always have
+        if paginated:
+            paginator = RankedSearchPagination()
+            page = paginator.paginate_search(search, request, view=self)
+        else:
+            page = search.after(0)
+        recipes = ranked_recipes([recipe_id for _, recipe_id in page])
+        
+        serializer = RecipeSerializer(recipes, many=True, context={'request': request})
+        if paginated:
+            return paginator.get_paginated_response(serializer.data)
+        return Response(serializer.data)
 
 class MarkRecipeCookedView(APIView):
     """Mark a recipe as cooked by the user"""
@@ -153,10 +214,6 @@ class MarkRecipeCookedView(APIView):
         recipe = get_object_or_404(Recipe, pk=recipe_id)
         
         # Record cook interaction
-        RecipeInteraction.objects.create(
-            user=request.user,
-            recipe=recipe,
-            interaction_type='cook'
-        )
+        record_interaction(request.user, recipe, 'cook')
         
         return Response({'success': True})
\ No newline at end of file
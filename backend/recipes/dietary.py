@@ -0,0 +1,273 @@
+"""
+Rule-based dietary tagging.
+
+A recipe gets every tag in TAG_EXCLUSIONS except those for which one of its
+ingredient names contains an excluded ingredient (a plain substring match on
+the lowercased names). DietaryClassifier compiles all the exclusion lists
+into one PatternMatcher, so classifying a recipe is one pass over its
+ingredient text.
+
+Tags are kept up to date incrementally: new recipes and changes to a
+recipe's ingredients call retag_on_commit() (see recommendations/signals.py),
+and every recipe queued in a transaction is retagged together once it
+commits. The add_dietary_tags command retags the whole catalog, which is
+only needed after the rules change.
+"""
+from cuisine_craft_project.transactions import CommitBatch
+from recipes.matching import PatternMatcher
+from recipes.models import Recipe, RecipeIngredient
+from recommendations.indexes import dietary_index
+
+# Recipes read and written per query
+RETAG_BATCH_SIZE = 1000
+
+# Ingredient indicators for each restriction
+NON_VEGETARIAN_INGREDIENTS = [
+    'beef', 'chicken', 'pork', 'lamb', 'turkey', 'bacon', 'ham', 'sausage',
+    'meat', 'veal', 'duck', 'goose', 'rabbit', 'venison', 'bison', 'quail',
+    'pheasant', 'goat', 'mutton', 'prosciutto', 'salami', 'pepperoni', 'gelatin',
+    'anchovy', 'sardine', 'mackerel', 'tuna', 'salmon', 'trout', 'herring',
+    'crab', 'lobster', 'shrimp', 'prawn', 'clam', 'mussel', 'oyster', 'scallop',
+    'octopus', 'squid', 'cuttlefish', 'escargot', 'snail', 'frog', 'turtle',
+    'eel', 'shark', 'whale', 'horse', 'kangaroo', 'crocodile', 'alligator',
+    'crayfish', 'crawfish', 'langoustine', 'scampi', 'conch', 'abalone', 'geoduck',
+    'crabmeat', 'lobster meat', 'shrimp meat', 'prawn meat', 'clam meat',
+    'mussel meat', 'oyster meat', 'scallop meat', 'octopus meat', 'squid meat',
+    'cuttlefish meat', 'escargot meat', 'snail meat', 'frog legs', 'turtle meat',
+    'eel meat', 'shark meat', 'whale meat', 'horse meat', 'kangaroo meat',
+    'bone broth', 'fish sauce', 'worcestershire sauce', 'animal rennet', 'lard', 
+    'suet', 'caviar', 'roe', 'fish stock', 'beef stock', 'chicken stock', 'dashi',
+    'fish broth', 'beef broth', 'chicken broth', 'bone marrow', 'foie gras',
+    'sweetbreads', 'liver', 'kidney', 'heart', 'tongue', 'tripe', 'oxtail'
+]
+
+NON_VEGAN_INGREDIENTS = [
+    'milk', 'cream', 'cheese', 'butter', 'yogurt', 'egg', 'honey', 
+    'whey', 'casein', 'lactose', 'ghee', 'ice cream', 'mayonnaise',
+    'gelatin', 'lard', 'isenglass', 'carmine', 'shellac', 'albumen',
+    'beeswax', 'bone char', 'charcoal', 'casein', 'rennet', 'taurine',
+    'vitamin D3', 'lanolin', 'collagen', 'elastin', 'keratin', 'silk',
+    'royal jelly', 'propolis', 'cochineal', 'confectioner\'s glaze', 
+    'E120', 'E542', 'E901', 'E904', 'E471', 'buttermilk', 'custard',
+    'quark', 'cottage cheese', 'sour cream'
+] + NON_VEGETARIAN_INGREDIENTS
+
+GLUTEN_INGREDIENTS = [
+    'wheat', 'barley', 'rye', 'malt', 'couscous', 'semolina', 'spelt',
+    'farina', 'farro', 'graham flour', 'kamut', 'bulgur', 'durum',
+    'triticale', 'flour', 'bread', 'pasta', 'cereal', 'beer', 'ale',
+    'lager', 'stout', 'porter', 'malt vinegar', 'soy sauce', 'teriyaki',
+    'seitan', 'wheat starch', 'wheat germ', 'wheat bran', 'wheat protein',
+    'orzo', 'freekeh', 'matzo', 'fu', 'hing', 'asafoetida', 'udon',
+    'soba', 'bread crumbs', 'croutons', 'panko', 'noodles', 'pastry',
+    'cake', 'cookie', 'crackers', 'pie crust', 'phyllo', 'biscuit',
+    'pretzel', 'tortilla', 'pita'
+]
+
+NON_HALAL_INGREDIENTS = [
+    'pork', 'bacon', 'ham', 'gelatin', 'pepperoni', 'alcohol', 'wine',
+    'beer', 'rum', 'lard', 'pork gelatin', 'pork fat', 'pork rind',
+    'pork sausage', 'pork bacon', 'pork ham', 'pork chop', 'pork loin',
+    'pork ribs', 'pork belly', 'pork shoulder', 'pork tenderloin',
+    'marsala wine', 'cooking wine', 'sake', 'vodka', 'whiskey', 'brandy',
+    'liqueur', 'kirsch', 'animal rennet', 'ethanol', 'gin', 'vermouth',
+    'port wine', 'sherry', 'tequila', 'bourbon', 'scotch'
+]
+
+SEAFOOD_INGREDIENTS = [
+    'fish', 'salmon', 'tuna', 'cod', 'shrimp', 'prawn', 'lobster',
+    'crab', 'squid', 'octopus', 'clam', 'mussel', 'oyster', 'scallop',
+    'anchovy', 'tilapia', 'halibut', 'mackerel', 'sardine', 'trout',
+    'seaweed', 'nori', 'kombu', 'wakame', 'bonito flakes', 'fish sauce', 
+    'oyster sauce', 'fish paste', 'shrimp paste', 'surimi', 'caviar', 
+    'roe', 'fish stock', 'dashi', 'sushi', 'unagi', 'sea bass', 'catfish',
+    'mahi mahi', 'perch', 'snapper', 'flounder', 'haddock', 'sole', 'lox'
+]
+
+DAIRY_INGREDIENTS = [
+    'milk', 'cream', 'cheese', 'butter', 'yogurt', 'whey', 
+    'casein', 'lactose', 'ghee', 'ice cream', 'buttermilk',
+    'quark', 'cottage cheese', 'ricotta', 'mascarpone', 'kefir',
+    'sour cream', 'half and half', 'condensed milk', 'evaporated milk',
+    'powdered milk', 'whipping cream', 'creme fraiche', 'buttercream',
+    'brie', 'cheddar', 'mozzarella', 'parmesan', 'feta', 'gouda',
+    'swiss cheese', 'blue cheese', 'goat cheese', 'paneer', 'milk solids'
+]
+
+PEANUT_INGREDIENTS = [
+    'peanut', 'groundnut', 'peanut butter', 'peanut oil', 'peanut flour',
+    'arachis oil', 'monkey nuts', 'satay sauce', 'peanut sauce',
+    'beer nuts', 'mixed nuts', 'nut mix'
+]
+
+TREE_NUT_INGREDIENTS = [
+    'almond', 'walnut', 'cashew', 'pecan', 'hazelnut', 'pistachio',
+    'macadamia', 'brazil nut', 'pine nut', 'coconut', 'chestnut', 
+    'hickory nut', 'beechnut', 'ginkgo nut', 'shea nuts', 'pesto', 
+    'marzipan', 'nougat', 'walnut oil', 'almond oil', 'praline', 
+    'amaretto', 'frangelico', 'almond milk', 'almond butter',
+    'almond extract', 'almond paste', 'cashew butter', 'nutella'
+]
+
+WHEAT_INGREDIENTS = [
+    'wheat', 'flour', 'bread', 'pasta', 'couscous', 'semolina', 
+    'bran', 'farina', 'wheat germ', 'cracked wheat', 'freekeh',
+    'seitan', 'bulgur', 'panko breadcrumbs', 'filo', 'phyllo',
+    'wheat starch', 'wheat noodles', 'udon', 'ramen', 'cake flour',
+    'all-purpose flour', 'bread flour', 'pastry flour'
+]
+
+SESAME_INGREDIENTS = [
+    'sesame', 'tahini', 'sesame oil', 'sesame seed', 'halvah',
+    'gomasio', 'sesame salt', 'hummus', 'benne seed', 'sesame paste',
+    'sesame seasoning', 'sesame snaps', 'goma'
+]
+
+SOY_INGREDIENTS = [
+    'soy', 'tofu', 'miso', 'tempeh', 'edamame', 'soya',
+    'soy sauce', 'tamari', 'soy lecithin', 'soy protein',
+    'soy milk', 'textured vegetable protein', 'tvp', 'okara',
+    'yuba', 'natto', 'soy nuts', 'soy flour', 'soy oil',
+    'soybean', 'shoyu', 'teriyaki', 'vegetable protein'
+]
+
+SULPHITE_INGREDIENTS = [
+    'wine', 'dried fruit', 'vinegar', 'sulphite', 'sulfite',
+    'wine vinegar', 'dried vegetables', 'fruit juice', 'molasses',
+    'sauerkraut', 'pickled foods', 'beer', 'cider', 'wine coolers',
+    'grape juice', 'bottled lemon juice', 'bottled lime juice',
+    'dried apricots', 'dried prunes', 'maraschino cherries'
+]
+
+EGG_INGREDIENTS = [
+    'egg', 'mayonnaise', 'meringue', 'albumin', 'egg white',
+    'egg yolk', 'eggnog', 'egg powder', 'egg substitutes',
+    'lecithin', 'livetin', 'lysozyme', 'hollandaise sauce',
+    'custard', 'meringue powder', 'surimi', 'caesar dressing',
+    'aioli', 'quiche', 'frittata', 'egg noodles', 'egg wash',
+    'cake', 'cookie', 'muffin', 'pancake'
+]
+
+# A recipe loses a tag if its ingredient text contains any of the tag's ingredients
+TAG_EXCLUSIONS = {
+    'vegetarian': NON_VEGETARIAN_INGREDIENTS,
+    'vegan-friendly': NON_VEGAN_INGREDIENTS,
+    'gluten-free': GLUTEN_INGREDIENTS,
+    'halal': NON_HALAL_INGREDIENTS,
+    'seafood-free': SEAFOOD_INGREDIENTS,
+    'dairy-free': DAIRY_INGREDIENTS,
+    'peanut-free': PEANUT_INGREDIENTS,
+    'tree-nut-free': TREE_NUT_INGREDIENTS,
+    'wheat-free': WHEAT_INGREDIENTS,
+    'sesame-free': SESAME_INGREDIENTS,
+    'soy-free': SOY_INGREDIENTS,
+    'sulphite-free': SULPHITE_INGREDIENTS,
+    'egg-free': EGG_INGREDIENTS,
+}
+
+
+class DietaryClassifier:
+    """Dietary tags for a recipe from its ingredient names"""
+
+    def __init__(self, tag_exclusions=TAG_EXCLUSIONS):
+        self.tags = list(tag_exclusions)
+        self._matcher = PatternMatcher(tag_exclusions)
+
+    def classify(self, ingredient_names):
+        """Tags (in self.tags order) a recipe with these ingredients qualifies for"""
+        excluded = self._matcher.labels_in(' '.join(name.lower() for name in ingredient_names))
+        return [tag for tag in self.tags if tag not in excluded]
+
+
+dietary_classifier = DietaryClassifier()
+
+
+def _recipe_batches(recipe_ids, batch_size):
+    recipes = Recipe.objects.order_by('recipe_id')
+    if recipe_ids is not None:
+        recipe_ids = sorted(recipe_ids)
+        for start in range(0, len(recipe_ids), batch_size):
+            yield list(
+                recipes.filter(recipe_id__in=recipe_ids[start:start + batch_size])
+                .values_list('recipe_id', 'dietary_tags')
+            )
+        return
+    last_id = 0
+    while True:
+        batch = list(recipes.filter(recipe_id__gt=last_id).values_list('recipe_id', 'dietary_tags')[:batch_size])
+        if not batch:
+            return
+        last_id = batch[-1][0]
+        yield batch
+
+
+def _recipe_ingredient_names(recipe_ids=None, batch_size=RETAG_BATCH_SIZE):
+    """
+    (recipe_id, dietary_tags, ingredient names) for the given recipes, or all
+    of them, reading batch_size recipes per query
+    """
+    for batch in _recipe_batches(recipe_ids, batch_size):
+        ingredients = {}
+        rows = (
+            RecipeIngredient.objects.filter(recipe_id__in=[recipe_id for recipe_id, _ in batch])
+            .order_by('recipe_id', 'id')
+            .values_list('recipe_id', 'ingredient__name')
+        )
+        for recipe_id, name in rows:
+            ingredients.setdefault(recipe_id, []).append(name)
+
+        for recipe_id, tags in batch:
+            yield recipe_id, tags, ingredients.get(recipe_id, [])
+
+
+def retag_recipes(recipe_ids=None, reset=False, classifier=dietary_classifier, batch_size=RETAG_BATCH_SIZE):
+    """
+    Recompute the dietary tags of the given recipes (default: all), write the
+    ones that changed (all of them with reset) and update the dietary tag
+    index to match. Returns (recipes processed, recipes updated).
+    """
+    processed = updated = 0
+    changed = []
+    for recipe_id, old_tags, ingredient_names in _recipe_ingredient_names(recipe_ids, batch_size):
+        tags = classifier.classify(ingredient_names)
+        if reset or set(tags) != set(old_tags or []):
+            changed.append(Recipe(recipe_id=recipe_id, dietary_tags=tags))
+        processed += 1
+        if len(changed) >= batch_size:
+            updated += _save_tags(changed, rebuild_index=recipe_ids is None)
+            changed = []
+    updated += _save_tags(changed, rebuild_index=recipe_ids is None)
+
+    if recipe_ids is None:
+        # Cheaper to rebuild the bitmaps once than to patch every recipe
+        dietary_index.invalidate()
+    elif updated:
+        dietary_index.publish_change()
+    return processed, updated
+
+
+def _save_tags(recipes, rebuild_index):
+    # bulk_update skips post_save, so the index is patched here
+    Recipe.objects.bulk_update(recipes, ['dietary_tags'])
+    if not rebuild_index:
+        for recipe in recipes:
+            dietary_index.update_recipe(recipe.recipe_id, recipe.dietary_tags)
+    return len(recipes)
+
+
+def _retag_committed(recipe_ids):
+    # reset writes and indexes every queued recipe, so a new recipe that was
+    # created with the right tags still gets its bits in the dietary index
+    retag_recipes(recipe_ids, reset=True)
+
+
+_pending_retags = CommitBatch(_retag_committed)
+
+
+def retag_on_commit(*recipe_ids):
+    """
+    Retag recipes once the current transaction commits. Recipes changed in
+    the same transaction are retagged together; ones queued by a
+    transaction that rolls back are dropped with it.
+    """
+    _pending_retags.add(*recipe_ids)
@@ -0,0 +1,369 @@
+"""
+HTTP side of the TheMealDB import (see the import_recipes command).
+
+MealDBClient fetches API pages over one pooled requests.Session shared by
+all worker threads. A TokenBucket bounds the request rate across them in
+place of fixed sleeps between requests, and failed requests are retried
+with exponential backoff. Pointing base_url at a local server that serves
+recorded API responses makes the import testable offline.
+
+ImageFetcher downloads recipe images on its own thread pool, so they don't
+hold up the database writes, and records how each fetch went.
+
+RecipeWriter stores the parsed meals in batches, a fixed handful of queries
+per batch rather than a few per ingredient.
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import requests
+from django.db import transaction
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ingredients.models import Ingredient
+from recipes.dietary import retag_recipes
+from recipes.models import Recipe, RecipeIngredient
+from recommendations import popularity
+from recommendations.indexes import ingredient_index, ingredient_matrix
+
+MEALDB_BASE_URL = 'https://www.themealdb.com/api/json/v1/1'
+
+# Meals RecipeWriter writes per transaction
+IMPORT_BATCH_SIZE = 100
+
+# A meal parsed from the API: the recipe's fields and {ingredient name: measurement}
+ImportedMeal = namedtuple(
+    'ImportedMeal', ['meal_id', 'title', 'instructions', 'dietary_tags', 'image_url', 'ingredients']
+)
+
+
+class TokenBucket:
+    """
+    Thread-safe rate limiter: acquire() takes a token, waiting for one if
+    needed. Tokens accrue at rate per second, up to capacity (the largest
+    burst allowed after a quiet period).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class MealDBClient:
+    """TheMealDB API client for use from several threads at once"""
+
+    def __init__(self, base_url=MEALDB_BASE_URL, rate=2.0, pool_size=4, retries=3, backoff=1.0,
+                 timeout=10, warn=None):
+        self.base_url = base_url.rstrip('/')
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.warn = warn or (lambda message: None)
+        self.rate_limiter = TokenBucket(rate)
+
+        # Keep one connection per worker alive instead of reconnecting per request
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, **kwargs):
+        """GET url (rate limited, with retries); returns the response or None"""
+        attempts = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.get(url, timeout=self.timeout, **kwargs)
+                response.raise_for_status()  # Raise exception for 4XX/5XX responses
+                return response
+            except requests.exceptions.RequestException as e:
+                attempts += 1
+                if attempts >= self.retries:
+                    self.warn(f"API request failed after {self.retries} attempts: {e}")
+                    return None
+                wait_time = self.backoff * (2 ** attempts)  # Exponential backoff
+                self.warn(f"API request failed ({e}). Retrying in {wait_time}s... (Attempt {attempts}/{self.retries})")
+                time.sleep(wait_time)
+
+    def get_json(self, endpoint, **params):
+        response = self.get(f'{self.base_url}/{endpoint}', params=params)
+        if response is None:
+            return None
+        try:
+            return response.json()
+        except ValueError as e:
+            self.warn(f"Invalid JSON from {response.url}: {e}")
+            return None
+
+    def meals_by_first_letter(self, letter):
+        """All meals whose name starts with letter (empty if none or on failure)"""
+        data = self.get_json('search.php', f=letter)
+        return (data or {}).get('meals') or []
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Outcome of one image fetch. status is 'downloaded', 'exists' (a file of that
+# name was already there), 'duplicate' (same content as an existing file, which
+# it was linked to) or 'failed'; seconds is the download time.
+ImageResult = namedtuple('ImageResult', ['name', 'url', 'status', 'seconds', 'size', 'error'])
+
+
+class ImageFetcher:
+    """
+    Downloads images into directory on a pool of worker threads sharing one
+    connection pool. submit() returns immediately; results() waits for all
+    submitted images.
+
+    Files already present under their name are not downloaded again, and a
+    download whose content matches an existing file (by SHA-256) is hard-linked
+    to it instead of stored twice. Files are written to a temporary name and
+    renamed into place, so an interrupted import never leaves a partial image.
+    """
+
+    def __init__(self, directory, workers=8, retries=3, backoff=1.0, timeout=10):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=workers,
+            max_retries=Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504))
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='images')
+
+        self._futures = {}
+        self._hashes = None
+        self._hashes_lock = threading.Lock()
+
+    def submit(self, url, name):
+        """Fetch url into directory/name in the background (once per name)"""
+        if name not in self._futures:
+            self._futures[name] = self._executor.submit(self._fetch, url, name)
+        return self._futures[name]
+
+    def results(self):
+        """ImageResults of every submitted image, waiting for the ones still running"""
+        return [future.result() for future in self._futures.values()]
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _fetch(self, url, name):
+        path = self.directory / name
+        if path.is_file() and path.stat().st_size:
+            return ImageResult(name, url, 'exists', 0.0, path.stat().st_size, None)
+
+        started = time.perf_counter()
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            content = response.content
+        except requests.exceptions.RequestException as e:
+            return ImageResult(name, url, 'failed', time.perf_counter() - started, 0, str(e))
+        seconds = time.perf_counter() - started
+
+        digest = hashlib.sha256(content).hexdigest()
+        with self._hashes_lock:
+            hashes = self._content_hashes()
+            original = hashes.setdefault(digest, name)
+
+        try:
+            if original != name and self._link(self.directory / original, path):
+                return ImageResult(name, url, 'duplicate', seconds, len(content), None)
+            self._write(path, content)
+        except OSError as e:
+            return ImageResult(name, url, 'failed', seconds, 0, str(e))
+        return ImageResult(name, url, 'downloaded', seconds, len(content), None)
+
+    def _content_hashes(self):
+        # {sha256: file name} of the images in the directory, read once
+        if self._hashes is None:
+            self._hashes = {}
+            for path in sorted(self.directory.iterdir()):
+                if path.is_file() and not path.name.startswith('.'):
+                    self._hashes.setdefault(hashlib.sha256(path.read_bytes()).hexdigest(), path.name)
+        return self._hashes
+
+    def _write(self, path, content):
+        temp_path = self.directory / f'.{path.name}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(temp_path, 'xb') as temp_file:
+                temp_file.write(content)
+            os.replace(temp_path, path)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+    def _link(self, original, path):
+        # Hard-link path to original; False if that isn't possible (e.g. the
+        # original is still being written or links aren't supported)
+        temp_path = self.directory / f'.{path.name}.{uuid.uuid4().hex}.link'
+        try:
+            os.link(original, temp_path)
+            os.replace(temp_path, path)
+            return True
+        except OSError:
+            temp_path.unlink(missing_ok=True)
+            return False
+
+
+def image_fetch_stats(results):
+    """Counts per status, bytes downloaded and download latency percentiles (ms)"""
+    stats = {status: 0 for status in ('downloaded', 'exists', 'duplicate', 'failed')}
+    for result in results:
+        stats[result.status] += 1
+    stats['bytes'] = sum(result.size for result in results if result.status in ('downloaded', 'duplicate'))
+
+    latencies = np.array([result.seconds for result in results if result.status != 'exists']) * 1000
+    if len(latencies):
+        stats['p50_ms'], stats['p95_ms'], stats['max_ms'] = np.percentile(latencies, [50, 95, 100])
+    return stats
+
+
+class RecipeWriter:
+    """
+    Writes ImportedMeals batch_size at a time, each batch in one transaction:
+    the recipes with bulk_create (bulk_update for existing ones with
+    force_update, otherwise they are skipped), any new ingredients with one
+    bulk_create, and all the batch's RecipeIngredient rows with another.
+    Ingredient IDs are kept in memory by name for the whole import.
+
+    Bulk writes don't send post_save, so once a batch commits the writer does
+    what the signal handlers would: invalidates the ingredient indexes,
+    retags the batch's recipes (which patches the dietary index) and drops
+    the cached popularity ranking so the new recipes show up in it.
+    """
+
+    def __init__(self, force_update=False, batch_size=IMPORT_BATCH_SIZE, log=None):
+        self.force_update = force_update
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self._pending = []
+        self._ingredient_ids = None
+
+    def add(self, meal):
+        """Queue a meal; returns the meals written if that completed a batch"""
+        self._pending.append(meal)
+        if len(self._pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """Write the queued meals; returns the ones created or updated"""
+        meals, self._pending = self._pending, []
+        if not meals:
+            return []
+        try:
+            with transaction.atomic():
+                written = self._write(meals)
+                recipe_ids = [recipe.recipe_id for recipe, _ in written]
+                transaction.on_commit(lambda: self._refresh_catalog(recipe_ids))
+        except Exception:
+            # Ingredient IDs created in the rolled back transaction are gone
+            self._ingredient_ids = None
+            raise
+        return [meal for _, meal in written]
+
+    def _write(self, meals):
+        existing = {}
+        for recipe in Recipe.objects.filter(title__in={meal.title for meal in meals}).order_by('recipe_id'):
+            existing.setdefault(recipe.title, recipe)
+
+        created, updated, written, seen = [], [], [], set()
+        for meal in meals:
+            recipe = existing.get(meal.title)
+            if meal.title in seen or (recipe is not None and not self.force_update):
+                self.log(f'Recipe "{meal.title}" already exists, skipping...')
+                continue
+            seen.add(meal.title)
+
+            if recipe is None:
+                recipe = Recipe(title=meal.title)
+                created.append(recipe)
+                self.log(f'Creating new recipe: {meal.title}')
+            else:
+                updated.append(recipe)
+                self.log(f'Updating existing recipe: {meal.title}')
+            recipe.instructions = meal.instructions
+            recipe.dietary_tags = meal.dietary_tags
+            recipe.image_url = meal.image_url
+            written.append((recipe, meal))
+
+        # Sets recipe_id on the new recipes (on backends that return inserted rows)
+        Recipe.objects.bulk_create(created)
+        if updated:
+            Recipe.objects.bulk_update(updated, ['instructions', 'dietary_tags', 'image_url'])
+            RecipeIngredient.objects.filter(recipe__in=updated).delete()
+
+        ingredient_ids = self._ingredient_ids_for({name for _, meal in written for name in meal.ingredients})
+        RecipeIngredient.objects.bulk_create(
+            [
+                RecipeIngredient(recipe=recipe, ingredient_id=ingredient_ids[name], measurement=measurement)
+                for recipe, meal in written
+                for name, measurement in meal.ingredients.items()
+            ],
+            batch_size=1000
+        )
+        return written
+
+    def _ingredient_ids_for(self, names):
+        if self._ingredient_ids is None:
+            self._ingredient_ids = dict(Ingredient.objects.values_list('name', 'ingredient_id'))
+        missing = names - self._ingredient_ids.keys()
+        if missing:
+            # Names created by someone else meanwhile are skipped, then read back like ours
+            Ingredient.objects.bulk_create([Ingredient(name=name) for name in sorted(missing)], ignore_conflicts=True)
+            self._ingredient_ids.update(
+                Ingredient.objects.filter(name__in=missing).values_list('name', 'ingredient_id')
+            )
+        return self._ingredient_ids
+
+    def _refresh_catalog(self, recipe_ids):
+        if not recipe_ids:
+            return
+        ingredient_index.invalidate()
+        ingredient_matrix.invalidate()
+        retag_recipes(recipe_ids, reset=True)
+        popularity.invalidate_ranking()
@@ -1,13 +1,11 @@
 from django.core.management.base import BaseCommand
-import requests
-import time
 import os
 from django.conf import settings
 from pathlib import Path
-import urllib.request
-from django.core.files import File
-from recipes.models import Recipe, RecipeIngredient
-from ingredients.models import Ingredient
+from concurrent.futures import ThreadPoolExecutor
+from recipes.importer import (
+    IMPORT_BATCH_SIZE, MEALDB_BASE_URL, ImageFetcher, ImportedMeal, MealDBClient, RecipeWriter, image_fetch_stats
+)
 
 class Command(BaseCommand):
     help = 'Import recipes from TheMealDB API'
@@ -15,8 +13,18 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--retry', type=int, default=3, 
                           help='Number of retries for failed API requests')
-        parser.add_argument('--delay', type=int, default=1,
-                          help='Delay in seconds between API requests')
+        parser.add_argument('--delay', type=float, default=1,
+                          help='Base delay in seconds for retry backoff')
+        parser.add_argument('--rate', type=float, default=2,
+                          help='Maximum API requests per second across all workers')
+        parser.add_argument('--workers', type=int, default=4,
+                          help='Number of concurrent API requests')
+        parser.add_argument('--image-workers', type=int, default=8,
+                          help='Number of concurrent image downloads')
+        parser.add_argument('--base-url', default=MEALDB_BASE_URL,
+                          help='TheMealDB API root (e.g. a local server replaying recorded responses)')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+                          help='Number of recipes written per transaction')
         parser.add_argument('--force', action='store_true',
                           help='Force update existing recipes')
 
@@ -25,6 +33,7 @@ class Command(BaseCommand):
         self.delay = options['delay']
         self.force_update = options['force']
         self.media_path = Path(settings.MEDIA_ROOT) / 'recipe_images'
+        workers = max(1, options['workers'])
         
         # Create media directory if it doesn't exist
         if not os.path.exists(self.media_path):
@@ -35,57 +44,58 @@ class Command(BaseCommand):
         # First, let's get a list of all available meals by first letter
         alphabet = 'abcdefghijklmnopqrstuvwxyz'
         
-        for letter in alphabet:
-            self.stdout.write(f'Fetching recipes starting with "{letter}"...')
-            url = f'https://www.themealdb.com/api/json/v1/1/search.php?f={letter}'
-            data = self._make_api_request(url)
+        client = MealDBClient(
+            base_url=options['base_url'],
+            rate=options['rate'],
+            pool_size=workers,
+            retries=self.retries,
+            backoff=self.delay,
+            warn=lambda message: self.stdout.write(self.style.WARNING(message))
+        )
+        self.writer = RecipeWriter(
+            force_update=self.force_update,
+            batch_size=max(1, options['batch_size']),
+            log=self.stdout.write
+        )
+        
+        # Images download in the background while the recipes are written
+        self.images = ImageFetcher(
+            self.media_path,
+            workers=max(1, options['image_workers']),
+            retries=self.retries,
+            backoff=self.delay
+        )
+        with client, self.images, ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mealdb') as executor:
+            pages = [(letter, executor.submit(client.meals_by_first_letter, letter)) for letter in alphabet]
             
-            if not data or not data.get('meals'):
-                self.stdout.write(f'No recipes found for letter "{letter}"')
-                continue
-                
-            for meal_data in data['meals']:
-                self._process_meal(meal_data)
-                
-            # Be nice to the API
-            time.sleep(self.delay)
+            # Pages are written in letter order on this thread while the
+            # workers keep fetching the ones after them
+            for letter, page in pages:
+                meals = page.result()
+                if not meals:
+                    self.stdout.write(f'No recipes found for letter "{letter}"')
+                    continue
+                    
+                self.stdout.write(f'Importing {len(meals)} recipes starting with "{letter}"...')
+                for meal_data in meals:
+                    self._process_meal(meal_data)
+            self._queue_images(self.writer.flush())
+            
+            self._report_images(self.images.results())
         
         self.stdout.write(self.style.SUCCESS('Recipe import completed!'))
     
-    def _make_api_request(self, url):
-        """Make API request with retries"""
-        attempts = 0
-        
-        while attempts < self.retries:
-            try:
-                response = requests.get(url, timeout=10)
-                response.raise_for_status()  # Raise exception for 4XX/5XX responses
-                return response.json()
-            except requests.exceptions.RequestException as e:
-                attempts += 1
-                if attempts < self.retries:
-                    wait_time = self.delay * (2 ** attempts)  # Exponential backoff
-                    self.stdout.write(self.style.WARNING(
-                        f"API request failed ({e}). Retrying in {wait_time}s... (Attempt {attempts}/{self.retries})"
-                    ))
-                    time.sleep(wait_time)
-                else:
-                    self.stdout.write(self.style.ERROR(f"API request failed after {self.retries} attempts: {e}"))
-                    return None
-    
     def _process_meal(self, meal_data):
-        """Process a single meal from the API and save to database"""
-        meal_id = meal_data['idMeal']
-        title = meal_data['strMeal']
-        
-        # Enhanced duplicate checking - check by title AND API meal_id
-        existing_recipe = Recipe.objects.filter(title=title).first()
-        
-        if existing_recipe and not self.force_update:
-            self.stdout.write(f'Recipe "{title}" already exists, skipping...')
-            return existing_recipe
-        
-        instructions = meal_data['strInstructions']
+        """Queue a single meal from the API for saving to the database"""
+        self._queue_images(self.writer.add(self._parse_meal(meal_data)))
+    
+    def _queue_images(self, meals):
+        """Download the images of the meals just written"""
+        for meal in meals:
+            if meal.image_url:
+                self._download_image(meal.image_url, meal.meal_id)
+    
+    def _parse_meal(self, meal_data):
         image_url = meal_data['strMealThumb'] if meal_data.get('strMealThumb') else None
         
         # Extract dietary tags if available
@@ -93,57 +103,46 @@ class Command(BaseCommand):
         if meal_data.get('strTags'):
             dietary_tags = [tag.strip() for tag in meal_data['strTags'].split(',')]
         
-        # Create or update recipe
-        if existing_recipe and self.force_update:
-            recipe = existing_recipe
-            recipe.instructions = instructions
-            recipe.dietary_tags = dietary_tags
-            recipe.image_url = image_url
-            self.stdout.write(f'Updating existing recipe: {title}')
-        else:
-            recipe = Recipe(
-                title=title,
-                instructions=instructions,
-                dietary_tags=dietary_tags,
-                image_url=image_url
-            )
-            self.stdout.write(f'Creating new recipe: {title}')
-        
-        # Download and save image
-        if image_url:
-            image_name = self._download_image(image_url, meal_id)
-            
-        recipe.save()
-        
-        # Process ingredients with measurements
-        self._process_ingredients(recipe, meal_data)
-        
-        return recipe
+        return ImportedMeal(
+            meal_id=meal_data['idMeal'],
+            title=meal_data['strMeal'],
+            instructions=meal_data['strInstructions'],
+            dietary_tags=dietary_tags,
+            image_url=image_url,
+            ingredients=self._parse_ingredients(meal_data)
+        )
     
     def _download_image(self, image_url, meal_id):
-        """Download image from URL and save to media folder"""
-        try:
-            # Extract file extension from URL
-            file_extension = os.path.splitext(image_url)[1] or '.jpg'
-            image_name = f'meal_{meal_id}{file_extension}'
-            image_path = os.path.join(self.media_path, image_name)
-            
-            # Download the image
-            urllib.request.urlretrieve(image_url, image_path)
-            self.stdout.write(f'Downloaded image: {image_name}')
-            return image_name
-        except Exception as e:
-            self.stdout.write(self.style.WARNING(f'Failed to download image: {e}'))
-            return None
+        """Queue an image download into the media folder; returns the file name"""
+        # Extract file extension from URL
+        file_extension = os.path.splitext(image_url)[1] or '.jpg'
+        image_name = f'meal_{meal_id}{file_extension}'
+        self.images.submit(image_url, image_name)
+        return image_name
     
-    def _process_ingredients(self, recipe, meal_data):
+    def _report_images(self, results):
+        """Print failed downloads and a summary of the image stage"""
+        for result in results:
+            if result.status == 'failed':
+                self.stdout.write(self.style.WARNING(f'Failed to download image {result.name}: {result.error}'))
+        
+        stats = image_fetch_stats(results)
+        summary = (
+            f"Images: {stats['downloaded']} downloaded, {stats['exists']} already present, "
+            f"{stats['duplicate']} duplicates linked, {stats['failed']} failed "
+            f"({stats['bytes'] / 1024:.0f} KiB)"
+        )
+        if 'p50_ms' in stats:
+            summary += (
+                f"; latency p50 {stats['p50_ms']:.0f} ms, p95 {stats['p95_ms']:.0f} ms, "
+                f"max {stats['max_ms']:.0f} ms"
+            )
+        self.stdout.write(summary)
+    
+    def _parse_ingredients(self, meal_data):
         """
-        Process ingredients and measurements from meal data
+        Ingredients and measurements from meal data, as {name: measurement}
         """
-        # Remove existing ingredients if updating
-        if self.force_update:
-            RecipeIngredient.objects.filter(recipe=recipe).delete()
-        
         # Dictionary to collect ingredients and their measurements
         # This will handle duplicated ingredients in TheMealDB data
         ingredient_dict = {}
@@ -164,27 +163,8 @@ class Command(BaseCommand):
             # If this ingredient was already seen in this recipe,
             # combine the measurements
             if ingredient_name in ingredient_dict:
-                ingredient_dict[ingredient_name]['measure'] += f", {measure}"
+                ingredient_dict[ingredient_name] += f", {measure}"
             else:
-                ingredient_dict[ingredient_name] = {
-                    'measure': measure
-                }
+                ingredient_dict[ingredient_name] = measure
         
-        # Now create recipe ingredients from our collected dictionary
-        for ingredient_name, data in ingredient_dict.items():
-            # Get or create the ingredient
-            ingredient, created = Ingredient.objects.get_or_create(
-                name=ingredient_name
-            )
-            
-            # Try to create a new RecipeIngredient relation or update if it exists
-            recipe_ingredient, created = RecipeIngredient.objects.get_or_create(
-                recipe=recipe,
-                ingredient=ingredient,
-                defaults={'measurement': data['measure']}
-            )
-            
-            # Update measurement if the relation already existed
-            if not created:
-                recipe_ingredient.measurement = data['measure']
-                recipe_ingredient.save()
\ No newline at end of file
+        return ingredient_dict
@@ -0,0 +1,80 @@
+"""
+Multi-pattern substring matching (Aho-Corasick).
+
+PatternMatcher compiles many labelled patterns into one automaton, after
+which finding every label whose patterns occur in a text is a single pass
+over the text, however many patterns there are. Matching is exact and
+case-sensitive, like `pattern in text`.
+"""
+
+
+class PatternMatcher:
+    """
+    Automaton over {label: [pattern, ...]}.
+
+    The goto/failure automaton is flattened into a complete transition table
+    (one dict per state, falling back to the root for characters that start
+    no pattern), and each state carries a bitmask of the labels whose
+    patterns end there or at any of its failure suffixes.
+    """
+
+    def __init__(self, labelled_patterns):
+        self.labels = list(labelled_patterns)
+        self._all_labels = (1 << len(self.labels)) - 1
+
+        # Trie of all patterns
+        transitions = [{}]
+        outputs = [0]
+        for bit, label in enumerate(self.labels):
+            for pattern in labelled_patterns[label]:
+                state = 0
+                for char in pattern:
+                    next_state = transitions[state].get(char)
+                    if next_state is None:
+                        next_state = len(transitions)
+                        transitions[state][char] = next_state
+                        transitions.append({})
+                        outputs.append(0)
+                    state = next_state
+                outputs[state] |= 1 << bit
+
+        # Breadth-first: fill in failure transitions and inherit outputs
+        failure = [0] * len(transitions)
+        queue = list(transitions[0].values())
+        for state in queue:
+            for char, next_state in list(transitions[state].items()):
+                queue.append(next_state)
+                fallback = failure[state]
+                while fallback and char not in transitions[fallback]:
+                    fallback = failure[fallback]
+                target = transitions[fallback].get(char, 0)
+                failure[next_state] = target if target != next_state else 0
+                outputs[next_state] |= outputs[failure[next_state]]
+            # Complete the table with the failure state's transitions (already
+            # complete, since it is shallower)
+            if state:
+                for char, next_state in transitions[failure[state]].items():
+                    transitions[state].setdefault(char, next_state)
+
+        self._transitions = transitions
+        self._outputs = outputs
+
+    def match_mask(self, text):
+        """Bitmask over self.labels of the labels with a pattern in text"""
+        transitions = self._transitions
+        outputs = self._outputs
+        all_labels = self._all_labels
+        state = 0
+        found = 0
+        for char in text:
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                found |= outputs[state]
+                if found == all_labels:
+                    break
+        return found
+
+    def labels_in(self, text):
+        """Set of the labels with a pattern occurring in text"""
+        found = self.match_mask(text)
+        return {label for bit, label in enumerate(self.labels) if found >> bit & 1}
@@ -0,0 +1,82 @@
+from django.db import migrations
+
+# Must match the names used by recipes.search
+SQLITE_FTS_TABLE = 'recipes_recipe_fts'
+POSTGRES_SEARCH_COLUMN = 'search_vector'
+
+SQLITE_FORWARD = [
+    f"""CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5(
+        title, instructions,
+        content='recipes_recipe', content_rowid='recipe_id',
+        tokenize='porter unicode61'
+    )""",
+    f"""CREATE TRIGGER {SQLITE_FTS_TABLE}_ai AFTER INSERT ON recipes_recipe BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, instructions)
+        VALUES (new.recipe_id, new.title, new.instructions);
+    END""",
+    f"""CREATE TRIGGER {SQLITE_FTS_TABLE}_ad AFTER DELETE ON recipes_recipe BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, instructions)
+        VALUES ('delete', old.recipe_id, old.title, old.instructions);
+    END""",
+    f"""CREATE TRIGGER {SQLITE_FTS_TABLE}_au AFTER UPDATE OF title, instructions ON recipes_recipe BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, instructions)
+        VALUES ('delete', old.recipe_id, old.title, old.instructions);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, instructions)
+        VALUES (new.recipe_id, new.title, new.instructions);
+    END""",
+    f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    f"DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}",
+]
+
+POSTGRES_FORWARD = [
+    f"""ALTER TABLE recipes_recipe ADD COLUMN {POSTGRES_SEARCH_COLUMN} tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(instructions, '')), 'B')
+        ) STORED""",
+    f"CREATE INDEX recipes_recipe_search_idx ON recipes_recipe USING GIN ({POSTGRES_SEARCH_COLUMN})",
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS recipes_recipe_search_idx",
+    f"ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS {POSTGRES_SEARCH_COLUMN}",
+]
+
+
+def _run(schema_editor, statements):
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_FORWARD)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_FORWARD)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_BACKWARD)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipeingredient_measurement'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
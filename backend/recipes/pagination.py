@@ -0,0 +1,146 @@
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Keyset pagination over recipes.
+
+    Cursors encode the position in the ordering rather than an offset, so
+    pages stay stable when recipes are added or filtered out by dietary
+    preferences between requests. Pagination is opt-in: clients that send
+    neither a cursor nor a page_size still get the plain list.
+
+    DRF's CursorPagination keys its cursor on the first ordering field plus
+    an offset. Here the cursor holds the values of every ordering field, so
+    with ('title', 'recipe_id') a page continues after (title, recipe_id)
+    and runs of equal titles never fall back to an offset. The ordering must
+    be ascending and end in a unique field.
+    """
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('title', 'recipe_id')
+
+    @classmethod
+    def requested(cls, request):
+        return cls.cursor_query_param in request.GET or cls.page_size_query_param in request.GET
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        self.position = self._decode_position(self.cursor.position) if self.cursor else None
+
+        if reverse:
+            queryset = queryset.order_by(*('-' + field for field in self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self._beyond(self.position, reverse))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = self.position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def _decode_position(self, encoded):
+        try:
+            position = json.loads(encoded)
+        except (TypeError, ValueError):
+            position = None
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def _beyond(self, position, reverse):
+        """Rows after position in the ordering (before it with reverse)"""
+        lookup = 'lt' if reverse else 'gt'
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            # Equal on the fields before this one, past position on this one
+            earlier = dict(zip(self.ordering[:index], position[:index]))
+            condition |= Q(**earlier, **{f'{field}__{lookup}': position[index]})
+        return condition
+
+    def _position_of(self, recipe):
+        return json.dumps([getattr(recipe, field) for field in self.ordering])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self._position_of(self.page[-1]) if self.page else json.dumps(self.position)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self._position_of(self.page[0]) if self.page else json.dumps(self.position)
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+
+class RecipeSearchCursorPagination(RecipeCursorPagination):
+    ordering = ('recipe_id',)
+
+
+class RankedSearchPagination(RecipeCursorPagination):
+    """
+    Cursor pagination over a RankedSearch, in relevance order.
+
+    The cursor holds a position in the ranked stream instead of an ordering
+    field value, and each page reads only as far into the stream as it
+    needs. Previous pages are read backwards from the first position of
+    the current one.
+    """
+
+    def paginate_search(self, search, request, view=None):
+        """The (position, recipe_id) entries of the requested page"""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        try:
+            position = int(cursor.position) if cursor else 0
+        except (TypeError, ValueError):
+            position = -1
+        if position < 0:
+            raise NotFound(self.invalid_cursor_message)
+
+        self.next_position = self.previous_position = None
+        if cursor is not None and cursor.reverse:
+            entries = search.before(position, self.page_size + 1)
+            page = entries[-self.page_size:]
+            self.next_position = position
+            if len(entries) > self.page_size:
+                self.previous_position = page[0][0]
+        else:
+            entries = search.after(position, self.page_size + 1)
+            page = entries[:self.page_size]
+            if len(entries) > self.page_size:
+                self.next_position = entries[self.page_size][0]
+            if position > 0:
+                self.previous_position = page[0][0] if page else position
+        return page
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=str(self.next_position)))
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=str(self.previous_position)))
@@ -0,0 +1,252 @@
+"""
+Full-text search over recipe titles and instructions.
+
+The index lives in the database and is maintained there, so it stays in sync
+with every write to recipes_recipe (including bulk operations):
+
+- SQLite: an external-content FTS5 table kept up to date by triggers,
+  ranked with bm25().
+- PostgreSQL: a generated tsvector column with a GIN index, ranked with
+  ts_rank_cd().
+
+Both are created by migration 0006_recipe_search_index. On any other
+backend search_recipe_ids falls back to a substring scan.
+
+Results are paged in the query itself (LIMIT/OFFSET), so a common word
+costs no more than a rare one; RankedSearch exposes them as a stream of
+positions for rank-preserving pagination.
+"""
+import re
+
+import numpy as np
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Q
+
+SQLITE_FTS_TABLE = 'recipes_recipe_fts'
+POSTGRES_SEARCH_COLUMN = 'search_vector'
+
+# Title matches count for more than instruction matches
+TITLE_WEIGHT = 10.0
+INSTRUCTIONS_WEIGHT = 1.0
+
+# Ranked ids RankedSearch reads per query
+SEARCH_CHUNK_SIZE = 100
+
+
+def search_terms(query):
+    """Split a free-text query into lowercase word tokens"""
+    return re.findall(r'\w+', query.lower())
+
+
+def _id_list(column, recipe_ids):
+    return f' AND {column} IN ({", ".join(["%s"] * len(recipe_ids))})', list(recipe_ids)
+
+
+def _fetch_ids(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _sqlite_match(terms):
+    # Quote every token so user input can't inject FTS5 query syntax, and
+    # prefix-match so "bak" still finds "baked"
+    return ' AND '.join(f'"{term}"*' for term in terms)
+
+
+def _sqlite_search(terms, limit, offset, among):
+    sql = f'SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s'
+    params = [_sqlite_match(terms)]
+    if among is not None:
+        clause, ids = _id_list('rowid', among)
+        sql += clause
+        params += ids
+    sql += f' ORDER BY bm25({SQLITE_FTS_TABLE}, %s, %s), rowid'
+    params += [TITLE_WEIGHT, INSTRUCTIONS_WEIGHT]
+    if limit is not None or offset:
+        # SQLite only takes OFFSET after a LIMIT (-1 meaning none)
+        sql += ' LIMIT %s OFFSET %s'
+        params += [-1 if limit is None else limit, offset]
+    return _fetch_ids(sql, params)
+
+
+def _sqlite_count(terms):
+    sql = f'SELECT count(*) FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s'
+    return _fetch_ids(sql, [_sqlite_match(terms)])[0]
+
+
+def _postgres_query(terms):
+    return ' & '.join(f'{term}:*' for term in terms)
+
+
+def _postgres_search(terms, limit, offset, among):
+    tsquery = _postgres_query(terms)
+    sql = (
+        f"SELECT recipe_id FROM recipes_recipe "
+        f"WHERE {POSTGRES_SEARCH_COLUMN} @@ to_tsquery('english', %s)"
+    )
+    params = [tsquery]
+    if among is not None:
+        clause, ids = _id_list('recipe_id', among)
+        sql += clause
+        params += ids
+    sql += f" ORDER BY ts_rank_cd({POSTGRES_SEARCH_COLUMN}, to_tsquery('english', %s)) DESC, recipe_id"
+    params.append(tsquery)
+    if limit is not None or offset:
+        # LIMIT NULL means no limit
+        sql += ' LIMIT %s OFFSET %s'
+        params += [limit, offset]
+    return _fetch_ids(sql, params)
+
+
+def _postgres_count(terms):
+    sql = (
+        f"SELECT count(*) FROM recipes_recipe "
+        f"WHERE {POSTGRES_SEARCH_COLUMN} @@ to_tsquery('english', %s)"
+    )
+    return _fetch_ids(sql, [_postgres_query(terms)])[0]
+
+
+def _substring_matches(query):
+    from recipes.models import Recipe
+
+    return Recipe.objects.filter(Q(title__icontains=query) | Q(instructions__icontains=query))
+
+
+def _substring_search(query, limit, offset, among):
+    recipe_ids = _substring_matches(query).order_by('recipe_id').values_list('recipe_id', flat=True)
+    if among is not None:
+        recipe_ids = recipe_ids.filter(recipe_id__in=among)
+    if limit is not None:
+        return list(recipe_ids[offset:offset + limit])
+    return list(recipe_ids[offset:])
+
+
+def _index_query(operations, terms, *args):
+    """Run the backend's query against the search index; None if it has none"""
+    operation = operations.get(connection.vendor)
+    if operation is None:
+        return None
+    try:
+        # Savepoint so a missing index doesn't break an enclosing transaction
+        with transaction.atomic():
+            return operation(terms, *args)
+    except DatabaseError:
+        # Index not migrated yet (or FTS5 unavailable)
+        return None
+
+
+def search_recipe_ids(query, limit=None, offset=0, among=None):
+    """
+    Ids of recipes matching every word of query, best match first, from
+    offset on. among restricts the search to the given recipe ids.
+    """
+    terms = search_terms(query)
+    if not terms or (among is not None and not len(among)):
+        return []
+    recipe_ids = _index_query(
+        {'sqlite': _sqlite_search, 'postgresql': _postgres_search}, terms, limit, offset, among
+    )
+    if recipe_ids is None:
+        recipe_ids = _substring_search(query, limit, offset, among)
+    return recipe_ids
+
+
+def count_matching_recipes(query):
+    """Number of recipes search_recipe_ids(query) finds"""
+    terms = search_terms(query)
+    if not terms:
+        return 0
+    count = _index_query({'sqlite': _sqlite_count, 'postgresql': _postgres_count}, terms)
+    if count is None:
+        count = _substring_matches(query).count()
+    return count
+
+
+class RankedSearch:
+    """
+    The recipes matching a query as one ranked stream: full-text matches in
+    relevance order, then the recipes in tagged_ids (e.g. those carrying the
+    query as a dietary tag) that didn't match the text.
+
+    Entries are addressed by their position in the stream. Recipes not in
+    allowed_ids (when given) are skipped without renumbering the others, so
+    a position stays a valid cursor whatever the filter. The stream is read
+    chunk_size entries at a time with LIMIT/OFFSET, so no query returns or
+    carries more than one chunk of ids.
+    """
+
+    def __init__(self, query, tagged_ids=(), allowed_ids=None, chunk_size=SEARCH_CHUNK_SIZE):
+        self.query = query
+        self.tagged_ids = np.asarray(tagged_ids, dtype=np.int64)
+        self.allowed_ids = allowed_ids
+        self.chunk_size = chunk_size
+        self._text_count = None
+
+    def _text_matches(self):
+        if self._text_count is None:
+            self._text_count = count_matching_recipes(self.query)
+        return self._text_count
+
+    def _entries(self, start, stop):
+        """
+        (position, recipe_id) of the entries in [start, stop), before
+        filtering, and whether the stream ends there
+        """
+        if not len(self.tagged_ids):
+            recipe_ids = search_recipe_ids(self.query, limit=stop - start, offset=start)
+            return list(zip(range(start, stop), recipe_ids)), len(recipe_ids) < stop - start
+
+        # Knowing where the text matches end places the tagged recipes after them
+        text_end = self._text_matches()
+        end = text_end + len(self.tagged_ids)
+        entries = []
+        if start < text_end:
+            recipe_ids = search_recipe_ids(self.query, limit=min(stop, text_end) - start, offset=start)
+            entries += zip(range(start, stop), recipe_ids)
+        if stop > text_end and start < end:
+            first = max(start, text_end)
+            tagged = self.tagged_ids[first - text_end:min(stop, end) - text_end].tolist()
+            text_matched = set(search_recipe_ids(self.query, among=tagged))
+            entries += [
+                (first + i, recipe_id) for i, recipe_id in enumerate(tagged)
+                if recipe_id not in text_matched
+            ]
+        return entries, stop >= end
+
+    def _visible(self, entries):
+        if self.allowed_ids is None or not entries:
+            return entries
+        allowed = np.isin([recipe_id for _, recipe_id in entries], self.allowed_ids)
+        return [entry for entry, keep in zip(entries, allowed) if keep]
+
+    def after(self, position, count=None):
+        """Up to count (position, recipe_id) entries at or after position, or all of them"""
+        size = self.chunk_size if count is None else max(self.chunk_size, count)
+        found = []
+        while count is None or len(found) < count:
+            entries, at_end = self._entries(position, position + size)
+            found += self._visible(entries)
+            if at_end:
+                break
+            position += size
+        return found[:count]
+
+    def before(self, position, count):
+        """Up to count (position, recipe_id) entries before position, in stream order"""
+        size = max(self.chunk_size, count)
+        found = []
+        while len(found) < count and position > 0:
+            start = max(0, position - size)
+            entries, _ = self._entries(start, position)
+            found = self._visible(entries) + found
+            position = start
+        return found[max(0, len(found) - count):]
+
+
+def ranked_recipes(recipe_ids):
+    """The given recipes as a list, in the order of recipe_ids"""
+    from recipes.models import Recipe
+
+    recipes = Recipe.objects.in_bulk(recipe_ids)
+    return [recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes]
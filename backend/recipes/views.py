@@ -3,8 +3,10 @@ from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
 from django.db.models import Q
 from .models import Recipe, SavedRecipe, RecipeIngredient
-from recommendations.models import DietaryPreference, RecipeInteraction
+from recommendations.models import DietaryPreference
+from recommendations.interactions import record_interaction
 from recommendations.text_utils import search_by_ingredients
+from recommendations.recommendation_engine import filter_by_dietary_preferences
 from rest_framework import serializers
 
 def recipe_list(request):
@@ -26,23 +28,9 @@ def recipe_list(request):
         favorite_recipe_ids = set(SavedRecipe.objects.filter(user=request.user).values_list('recipe__recipe_id', flat=True))
         
         if has_preferences:
-            # SQLite doesn't support JSON contains lookup, so we'll filter in Python
-            all_recipes = list(recipes)
-            filtered_recipes = []
-            
-            for recipe in all_recipes:
-                # Check if recipe matches all user preferences
-                if all(pref in recipe.dietary_tags for pref in user_preferences):
-                    filtered_recipes.append(recipe.recipe_id)
-            
-            # Filter the queryset by IDs we collected
-            if filtered_recipes:
-                recipes = recipes.filter(recipe_id__in=filtered_recipes)
-                filtered_by_preferences = True
-            else:
-                # No recipes match the preferences
-                recipes = Recipe.objects.none()
-                filtered_by_preferences = True
+            # Filter through the shared dietary tag index
+            recipes = filter_by_dietary_preferences(recipes, user_preferences)
+            filtered_by_preferences = True
     
     # Order recipes by title
     recipes = recipes.order_by('title')
@@ -65,11 +53,7 @@ def recipe_detail(request, recipe_id):
     
     # Record view interaction
     if request.user.is_authenticated:
-        RecipeInteraction.objects.create(
-            user=request.user,
-            recipe=recipe,
-            interaction_type='view'
-        )
+        record_interaction(request.user, recipe, 'view')
     
     # Check if the recipe is favorited by current user
     is_favorite = False
@@ -104,11 +88,7 @@ def toggle_favorite_recipe(request, recipe_id):
         interaction_type = 'favorite'
         
         # Record favorite interaction
-        RecipeInteraction.objects.create(
-            user=request.user,
-            recipe=recipe,
-            interaction_type='favorite'
-        )
+        record_interaction(request.user, recipe, 'favorite')
     
     # Redirect back to the page they were on or to the recipe detail page
     referer = request.META.get('HTTP_REFERER')
@@ -148,16 +128,7 @@ def search_recipes(request):
             ).values_list('restriction_type', flat=True))
             
             if preferences:
-                # Use a different approach to filter by preferences
-                # Create a list to store recipes that match all preferences
-                matching_recipe_ids = []
-                
-                for recipe in recipes:
-                    if all(pref in recipe.dietary_tags for pref in preferences):
-                        matching_recipe_ids.append(recipe.recipe_id)
-                
-                # Then filter the original queryset
-                recipes = Recipe.objects.filter(recipe_id__in=matching_recipe_ids)
+                recipes = filter_by_dietary_preferences(recipes, preferences)
         
         # Apply limit AFTER all filtering
         recipes = recipes[:12]
@@ -212,11 +183,7 @@ def mark_recipe_cooked(request, recipe_id):
     recipe = get_object_or_404(Recipe, pk=recipe_id)
     
     # Record cook interaction
-    RecipeInteraction.objects.create(
-        user=request.user,
-        recipe=recipe,
-        interaction_type='cook'
-    )
+    record_interaction(request.user, recipe, 'cook')
     
     # Redirect back to referrer
     referer = request.META.get('HTTP_REFERER')
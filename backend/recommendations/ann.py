@@ -0,0 +1,152 @@
+"""
+Approximate nearest-neighbour index over recipe TF-IDF vectors.
+
+For large catalogs neither an exact scan per query nor an all-pairs
+neighbour table scales. This index reduces the TF-IDF rows to dense float32
+vectors with TruncatedSVD and partitions them with k-means into inverted
+lists (IVF). A query scores the list centroids, then only the vectors in the
+`probes` closest lists, and finally re-scores the best `candidates` of those
+exactly against their TF-IDF rows, which recovers most of what the SVD loses.
+More probes or candidates means better recall and slower queries (see the
+benchmark_ann command). Vectors are stored grouped by list, so each probed
+list is one contiguous slice of the memory-mapped array.
+
+The index is optional: build_recommendation_index --ann builds it.
+"""
+import threading
+
+import numpy as np
+from django.conf import settings
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+
+from recommendations import artifacts
+
+ANN_ARTIFACT = 'ann'
+
+# Dimensions kept by the SVD
+ANN_DIMENSIONS = 128
+
+# Inverted lists probed per query unless settings.RECOMMENDATION_ANN_PROBES says otherwise
+ANN_PROBES = 8
+
+# Best approximate matches re-scored exactly, unless settings.RECOMMENDATION_ANN_CANDIDATES says otherwise
+ANN_CANDIDATES = 100
+
+
+def default_list_count(n):
+    """About sqrt(n) lists, the usual IVF starting point"""
+    return max(1, int(np.sqrt(n)))
+
+
+def build_ann_index(tfidf_matrix, recipe_ids, dimensions=ANN_DIMENSIONS, lists=None, seed=0):
+    """Reduce the TF-IDF rows with SVD and cluster them into inverted lists"""
+    n = tfidf_matrix.shape[0]
+    ids = np.asarray(recipe_ids, dtype=np.int32)
+    dimensions = max(1, min(dimensions, min(tfidf_matrix.shape) - 1))
+    lists = max(1, min(lists or default_list_count(n), n))
+
+    vectors = TruncatedSVD(n_components=dimensions, random_state=seed).fit_transform(tfidf_matrix)
+    vectors = vectors.astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms > 0, norms, 1)
+
+    kmeans = MiniBatchKMeans(n_clusters=lists, random_state=seed, n_init=3, batch_size=4096)
+    assignments = kmeans.fit_predict(vectors)
+    centroids = kmeans.cluster_centers_.astype(np.float32)
+
+    # Group the vectors by list; list l is rows offsets[l]:offsets[l + 1]
+    order = np.argsort(assignments, kind='stable')
+    offsets = np.zeros(lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=lists), out=offsets[1:])
+
+    return {
+        'recipe_ids': ids[order],
+        # Row of each entry in the TF-IDF matrix the index was built from
+        'tfidf_rows': order.astype(np.int32),
+        'vectors': vectors[order],
+        'centroids': centroids,
+        'offsets': offsets,
+    }
+
+
+class AnnIndex:
+    """Read-only view over a persisted IVF index"""
+
+    def __init__(self, arrays):
+        self.recipe_ids = arrays['recipe_ids']
+        self.tfidf_rows = arrays['tfidf_rows']
+        self.vectors = arrays['vectors']
+        self.centroids = arrays['centroids']
+        self.offsets = arrays['offsets']
+        self._rows = {int(recipe_id): row for row, recipe_id in enumerate(self.recipe_ids)}
+
+    def search(self, query, top_n, probes=None, exclude_row=None):
+        """Rows of the (approximately) top_n vectors most similar to query"""
+        probes = min(probes or getattr(settings, 'RECOMMENDATION_ANN_PROBES', ANN_PROBES), len(self.centroids))
+        centroid_scores = self.centroids @ query
+        if probes < len(centroid_scores):
+            probed = np.argpartition(-centroid_scores, probes - 1)[:probes]
+        else:
+            probed = np.arange(len(centroid_scores))
+
+        rows = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in probed])
+        if exclude_row is not None:
+            rows = rows[rows != exclude_row]
+        scores = self.vectors[rows] @ query
+
+        if len(rows) > top_n:
+            top = np.argpartition(-scores, top_n - 1)[:top_n]
+            rows, scores = rows[top], scores[top]
+        return rows[np.argsort(-scores, kind='stable')]
+
+    def neighbors(self, recipe_id, top_n, probes=None, candidates=None, tfidf_matrix=None):
+        """
+        Ids of approximately the top_n most similar recipes, or None if the
+        recipe isn't indexed. Pass the TF-IDF matrix the index was built from
+        to re-rank the best candidates by exact cosine similarity.
+        """
+        scored = self.scored_neighbors(recipe_id, top_n, probes, candidates, tfidf_matrix)
+        return None if scored is None else [similar_id for similar_id, _ in scored]
+
+    def scored_neighbors(self, recipe_id, top_n, probes=None, candidates=None, tfidf_matrix=None):
+        """Like neighbors(), as (id, similarity) pairs"""
+        row = self._rows.get(recipe_id)
+        if row is None:
+            return None
+        if tfidf_matrix is None or tfidf_matrix.shape[0] != len(self.recipe_ids):
+            rows = self.search(self.vectors[row], top_n, probes=probes, exclude_row=row)
+            scores = self.vectors[rows] @ self.vectors[row]
+        else:
+            candidates = candidates or getattr(settings, 'RECOMMENDATION_ANN_CANDIDATES', ANN_CANDIDATES)
+            rows = self.search(self.vectors[row], max(candidates, top_n), probes=probes, exclude_row=row)
+            scores = (tfidf_matrix[self.tfidf_rows[rows]] @ tfidf_matrix[self.tfidf_rows[row]].T).toarray().ravel()
+            order = np.argsort(-scores, kind='stable')[:top_n]
+            rows, scores = rows[order], scores[order]
+        return list(zip(self.recipe_ids[rows].tolist(), scores.tolist()))
+
+
+def save_ann_index(index, build=None):
+    return artifacts.save_artifact(
+        ANN_ARTIFACT, index, metadata={
+            'dimensions': index['vectors'].shape[1],
+            'lists': len(index['centroids']),
+            'build': build,
+        }
+    )
+
+
+_loaded = {'version': None, 'index': None}
+_load_lock = threading.Lock()
+
+
+def get_ann_index():
+    """The persisted ANN index, or None if it hasn't been built"""
+    version = artifacts.artifact_version(ANN_ARTIFACT)
+    if version != _loaded['version']:
+        with _load_lock:
+            if version != _loaded['version']:
+                loaded = artifacts.load_artifact(ANN_ARTIFACT)
+                _loaded['index'] = AnnIndex(loaded[1]) if loaded else None
+                _loaded['version'] = loaded[0]['version'] if loaded else version
+    return _loaded['index']
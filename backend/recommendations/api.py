@@ -6,9 +6,13 @@ from django.core.cache import cache
 from django.conf import settings
 from .models import DietaryPreference
 from .forms import DietaryPreferenceForm
-from .recommendation_engine import get_personalized_recommendations, invalidate_user_recommendations
+from .recommendation_engine import (
+    DEGRADED_RECOMMENDATIONS_TTL, get_ranked_recommendations, invalidate_user_recommendations, user_cache_key
+)
+from .precompute import precomputed_recommendation_ids
 from recipes.models import Recipe, SavedRecipe
 from recipes.api import RecipeSerializer
+from recipes.search import ranked_recipes
 
 # API Cache TTL (in seconds)
 API_CACHE_TTL = 15 * 60  # 15 minutes
@@ -20,7 +24,7 @@ class DietaryPreferenceView(APIView):
     def get(self, request):
         """Get user's dietary preferences"""
         # Try to get from cache
-        cache_key = f'api:dietary_preferences:{request.user.id}'
+        cache_key = user_cache_key('api:dietary_preferences', request.user.id)
         cached_response = cache.get(cache_key)
         
         if cached_response is not None:
@@ -62,8 +66,7 @@ class DietaryPreferenceView(APIView):
             )
         
         # Invalidate related caches
-        cache.delete(f'api:dietary_preferences:{request.user.id}')
-        invalidate_user_recommendations(request.user.id)
+        invalidate_user_recommendations(request.user.id, stored=True)
         
         return Response({'success': True})
 
@@ -82,25 +85,30 @@ class RecommendedRecipesView(APIView):
         
         # Check cache for recommendations if not explicitly refreshing
         if not refresh:
-            cache_key = f'api:recommended_recipes:{request.user.id}:{max_results}'
+            cache_key = user_cache_key('api:recommended_recipes', request.user.id, max_results)
             cached_data = cache.get(cache_key)
             
             if cached_data is not None:
                 return Response(cached_data)
         
-        # Get personalized recommendations
-        recommended_recipes = get_personalized_recommendations(request.user, max_results=max_results)
-        
-        # Add prefetch_related to optimize the serialization process
-        recommended_recipes = list(recommended_recipes)
-        
-        # Serialize the recipes
-        serializer = RecipeSerializer(recommended_recipes, many=True, context={'request': request})
+        # Serve the precomputed recommendations while they are fresh,
+        # otherwise compute them now
+        recipe_ids = None if refresh else precomputed_recommendation_ids(request.user.id, max_results)
+        cache_ttl = API_CACHE_TTL
+        if recipe_ids is None:
+            ranking = get_ranked_recommendations(request.user, max_results=max_results)
+            recipe_ids = ranking.recipe_ids
+            if ranking.dropped:
+                # Some candidate generators missed the budget; don't pin this ranking
+                cache_ttl = DEGRADED_RECOMMENDATIONS_TTL
+        
+        # Serialize the recipes (RecipeSerializer batch-loads ingredients and favorites)
+        serializer = RecipeSerializer(ranked_recipes(recipe_ids), many=True, context={'request': request})
         serialized_data = serializer.data
         
         # Cache the serialized data
-        cache_key = f'api:recommended_recipes:{request.user.id}:{max_results}'
-        cache.set(cache_key, serialized_data, API_CACHE_TTL)
+        cache_key = user_cache_key('api:recommended_recipes', request.user.id, max_results)
+        cache.set(cache_key, serialized_data, cache_ttl)
         
         return Response(serialized_data)
 
@@ -129,10 +137,16 @@ class AlmostMatchingRecipesView(APIView):
             force_refresh=refresh
         )
         
+        # Serialize all the recipes in one batch
+        recipes_data = RecipeSerializer(
+            [item['recipe'] for item in almost_matching],
+            many=True,
+            context={'request': request}
+        ).data
+        
         # Format the response
         results = []
-        for item in almost_matching:
-            recipe = item['recipe']
+        for item, recipe_data in zip(almost_matching, recipes_data):
             missing = item['missing_ingredients']
             
             # Get substitutions for each missing ingredient
@@ -152,14 +166,14 @@ class AlmostMatchingRecipesView(APIView):
             
             # Create response object
             results.append({
-                'recipe': RecipeSerializer(recipe, context={'request': request}).data,
+                'recipe': recipe_data,
                 'missing_ingredients': missing,
                 'substitutions': substitutions,
                 'missing_count': len(missing)
             })
         
         # Cache the results but with a short TTL
-        cache_key = f'api:almost_matching:{request.user.id}:{ingredients}:{max_missing}:{limit}'
+        cache_key = user_cache_key('api:almost_matching', request.user.id, ingredients, max_missing, limit)
         cache.set(cache_key, results, 60)  # Cache for only 1 minute
         
         return Response(results)
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+On-disk storage for precomputed recommendation artifacts.
+
+Each artifact (the TF-IDF matrix, the neighbour table, ...) is a directory of
+plain .npy files plus a manifest.json carrying the format version. Every save
+writes a fresh, uniquely stamped directory and then atomically repoints a
+symlink named after the artifact at it, so readers never see a half-written
+artifact. Worker processes open the arrays with mmap_mode='r' and share one
+page-cache copy instead of rebuilding or unpickling their own.
+
+    <RECOMMENDATION_ARTIFACTS_DIR>/
+        tfidf -> tfidf-20250101120000-1a2b3c4d/
+        tfidf-20250101120000-1a2b3c4d/
+            manifest.json
+            data.npy  indices.npy  indptr.npy  recipe_ids.npy  ...
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+# Bump when the layout of any artifact changes; older artifacts are ignored
+FORMAT_VERSION = 1
+
+# Superseded versions kept around for readers that still have them mapped
+KEEP_PREVIOUS_VERSIONS = 1
+
+
+def artifacts_root():
+    return Path(settings.RECOMMENDATION_ARTIFACTS_DIR)
+
+
+def artifact_version(name):
+    """Version stamp of the current artifact, or None if it was never built"""
+    try:
+        return os.readlink(artifacts_root() / name)
+    except OSError:
+        return None
+
+
+def save_artifact(name, arrays, metadata=None):
+    """
+    Write arrays and a manifest to a new version directory, then atomically
+    make it the current version of the artifact. Returns the version stamp.
+    """
+    root = artifacts_root()
+    root.mkdir(parents=True, exist_ok=True)
+
+    version = f'{name}-{time.strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex[:8]}'
+    directory = root / version
+    directory.mkdir()
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'name': name,
+        'version': version,
+        'created_at': time.time(),
+        'arrays': {},
+        'metadata': metadata or {},
+    }
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        np.save(directory / f'{key}.npy', array)
+        manifest['arrays'][key] = {'shape': list(array.shape), 'dtype': array.dtype.str}
+    with open(directory / 'manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    link = root / name
+    if link.is_dir() and not link.is_symlink():
+        # Left over from the unversioned layout
+        shutil.rmtree(link)
+    temp_link = root / f'.{version}.link'
+    os.symlink(version, temp_link)
+    os.replace(temp_link, link)
+
+    _prune_old_versions(name, current=version)
+    return version
+
+
+def _prune_old_versions(name, current):
+    root = artifacts_root()
+    versions = sorted(
+        path.name for path in root.glob(f'{name}-*')
+        if path.is_dir() and path.name != current
+    )
+    for version in versions[:len(versions) - KEEP_PREVIOUS_VERSIONS]:
+        shutil.rmtree(root / version, ignore_errors=True)
+
+
+def remove_artifact(name):
+    """
+    Stop serving an artifact. Its version directories are left for readers
+    that still have them mapped and pruned by later saves.
+    """
+    try:
+        os.unlink(artifacts_root() / name)
+    except FileNotFoundError:
+        pass
+
+
+def load_manifest(name):
+    """Manifest of the current version of an artifact, or None if unusable"""
+    version = artifact_version(name)
+    if version is None:
+        return None
+    try:
+        with open(artifacts_root() / version / 'manifest.json') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('format_version') != FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def load_artifact(name):
+    """
+    Memory-map the current version of an artifact.
+
+    Returns (manifest, arrays), or None if the artifact is missing or was
+    written in a different format version.
+    """
+    manifest = load_manifest(name)
+    if manifest is None:
+        return None
+    directory = artifacts_root() / manifest['version']
+    try:
+        arrays = {
+            key: np.load(directory / f'{key}.npy', mmap_mode='r')
+            for key in manifest['arrays']
+        }
+    except (OSError, ValueError):
+        return None
+    return manifest, arrays
+
+
+def artifact_size(name):
+    """Bytes on disk used by the current version of an artifact"""
+    version = artifact_version(name)
+    if version is None:
+        return 0
+    return sum(path.stat().st_size for path in (artifacts_root() / version).iterdir())
+
+
+def record_build(build, stages):
+    """Atomically write build.json describing the last complete index build"""
+    root = artifacts_root()
+    root.mkdir(parents=True, exist_ok=True)
+    temp_path = root / f'.build-{build}.json'
+    with open(temp_path, 'w') as f:
+        json.dump({'build': build, 'format_version': FORMAT_VERSION, 'built_at': time.time(), 'stages': stages}, f, indent=2)
+    os.replace(temp_path, root / 'build.json')
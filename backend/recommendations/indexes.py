@@ -0,0 +1,517 @@
+"""
+In-process indexes over the recipe catalog.
+
+Each index is built once per worker process and kept up to date by the
+handlers in recommendations/signals.py. A generation token stored in the cache
+lets the other worker processes notice that their copy is stale and rebuild it
+on next use.
+
+The build_recommendation_index command also persists every index as an
+artifact stamped with the generation it was built at; a worker whose shared
+generation still matches memory-maps that artifact instead of querying the
+database.
+"""
+import threading
+import uuid
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from django.core.cache import cache
+
+from recommendations import artifacts
+from recipes.models import Recipe, RecipeIngredient
+from ingredients.models import Ingredient
+from recommendations.forms import DietaryPreferenceForm
+
+EMPTY_IDS = np.empty(0, dtype=np.int64)
+
+# Upper bound on memoized term lookups kept per process
+TERM_CACHE_SIZE = 1024
+
+
+def ingredient_variant(term):
+    """
+    Return the substring that matches a search term in singular or plural form.
+
+    A name containing "tomatoes" also contains "tomatoe", and a name containing
+    "egg" covers "eggs", so a single substring check on the singular form gives
+    the same result as checking the term, its singular and its plural.
+    """
+    return term[:-1] if term.endswith('s') else term
+
+
+def ingredient_matches(recipe_ingredient, user_ingredient):
+    """Exact, partial or singular/plural match between two ingredient names"""
+    if recipe_ingredient == user_ingredient:
+        return True
+    singular = user_ingredient[:-1] if user_ingredient.endswith('s') else user_ingredient
+    plural = user_ingredient if user_ingredient.endswith('s') else user_ingredient + 's'
+    return any(
+        form in recipe_ingredient or recipe_ingredient in form
+        for form in (user_ingredient, singular, plural)
+    )
+
+
+class CatalogIndex:
+    """Base class for process-local indexes that share a cache generation token"""
+    generation_key = None
+    artifact_name = None
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._generation = None
+        self._built = False
+
+    def rebuild(self):
+        """Build the index from the database"""
+        raise NotImplementedError
+
+    def dump_arrays(self):
+        """Arrays to persist in the index artifact"""
+        raise NotImplementedError
+
+    def load_arrays(self, arrays):
+        """Restore the index from its (memory-mapped) artifact arrays"""
+        raise NotImplementedError
+
+    def _artifact_generation(self):
+        manifest = artifacts.load_manifest(self.artifact_name)
+        return manifest['metadata'].get('generation') if manifest else None
+
+    def _shared_generation(self):
+        generation = cache.get(self.generation_key)
+        if generation is None:
+            # No change has been published (or the key was culled): adopt the
+            # prebuilt artifact's generation, falling back to our own token
+            cache.add(
+                self.generation_key,
+                self._artifact_generation() or self._generation or uuid.uuid4().hex,
+                None,
+            )
+            generation = cache.get(self.generation_key)
+        return generation
+
+    def _load_artifact(self, generation):
+        loaded = artifacts.load_artifact(self.artifact_name)
+        if loaded is None or loaded[0]['metadata'].get('generation') != generation:
+            return False
+        self.load_arrays(loaded[1])
+        return True
+
+    def ensure_current(self):
+        """Build the index, or rebuild it if another process changed the catalog"""
+        generation = self._shared_generation()
+        if self._built and generation == self._generation:
+            return
+        with self._lock:
+            if not self._built or generation != self._generation:
+                if not self._load_artifact(generation):
+                    self.rebuild()
+                self._generation = generation
+                self._built = True
+
+    def build_artifact(self, build=None):
+        """
+        Rebuild from the database under a fresh generation and persist the
+        result. Returns the artifact version.
+        """
+        with self._lock:
+            # Publish the generation first: a change committed while we read
+            # the database bumps it again, so workers won't trust this artifact
+            generation = uuid.uuid4().hex
+            cache.set(self.generation_key, generation, None)
+            self.rebuild()
+            self._generation = generation
+            self._built = True
+            return artifacts.save_artifact(
+                self.artifact_name,
+                self.dump_arrays(),
+                metadata={'generation': generation, 'build': build},
+            )
+
+    def publish_change(self):
+        """Tell other processes that this process has applied a change"""
+        stale = cache.get(self.generation_key) != self._generation
+        generation = uuid.uuid4().hex
+        cache.set(self.generation_key, generation, None)
+        if stale:
+            # We missed someone else's change, so our copy must be rebuilt too
+            self._built = False
+        else:
+            self._generation = generation
+
+    def invalidate(self):
+        """Force every process, including this one, to rebuild on next use"""
+        cache.set(self.generation_key, uuid.uuid4().hex, None)
+        self._built = False
+
+
+class IngredientIndex(CatalogIndex):
+    """
+    Inverted index from lowercased ingredient name to the sorted array of
+    recipe ids that use it.
+
+    Search terms are matched as substrings of ingredient names, covering
+    singular and plural variants, and the resolved posting for each term is
+    memoized until the index changes.
+    """
+    generation_key = 'ingredient_index_generation'
+    artifact_name = 'ingredient_index'
+
+    def __init__(self):
+        super().__init__()
+        self._postings = {}
+        self._term_cache = {}
+
+    def rebuild(self):
+        recipe_names = {}
+        rows = RecipeIngredient.objects.values_list('recipe_id', 'ingredient__name').iterator()
+        for recipe_id, name in rows:
+            recipe_names.setdefault(recipe_id, set()).add(name.lower())
+
+        postings = {}
+        for recipe_id, names in recipe_names.items():
+            for name in names:
+                postings.setdefault(name, []).append(recipe_id)
+
+        self._postings = {
+            name: np.array(sorted(ids), dtype=np.int64)
+            for name, ids in postings.items()
+        }
+        self._term_cache = {}
+
+    def dump_arrays(self):
+        names = sorted(self._postings)
+        lengths = [len(self._postings[name]) for name in names]
+        return {
+            'names': np.array(names, dtype=str),
+            'indptr': np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]),
+            'recipe_ids': np.concatenate([self._postings[name] for name in names]) if names else EMPTY_IDS,
+        }
+
+    def load_arrays(self, arrays):
+        indptr, recipe_ids = arrays['indptr'], arrays['recipe_ids']
+        # Postings stay views into the mapped file; updates replace, never mutate
+        self._postings = {
+            name: recipe_ids[indptr[i]:indptr[i + 1]]
+            for i, name in enumerate(arrays['names'].tolist())
+        }
+        self._term_cache = {}
+
+    def _names_of(self, recipe_id):
+        names = set()
+        for name, posting in self._postings.items():
+            position = np.searchsorted(posting, recipe_id)
+            if position < len(posting) and posting[position] == recipe_id:
+                names.add(name)
+        return names
+
+    def update_recipe(self, recipe_id):
+        """Re-read one recipe's ingredients and patch the postings in place"""
+        if not self._built:
+            return
+        names = {
+            name.lower()
+            for name in RecipeIngredient.objects.filter(recipe_id=recipe_id)
+            .values_list('ingredient__name', flat=True)
+        }
+        with self._lock:
+            old_names = self._names_of(recipe_id)
+
+            for name in old_names - names:
+                posting = self._postings[name]
+                posting = posting[posting != recipe_id]
+                if len(posting):
+                    self._postings[name] = posting
+                else:
+                    del self._postings[name]
+
+            for name in names - old_names:
+                posting = self._postings.get(name, EMPTY_IDS)
+                position = np.searchsorted(posting, recipe_id)
+                self._postings[name] = np.insert(posting, position, recipe_id)
+
+            changed = old_names ^ names
+            self._term_cache = {
+                variant: ids for variant, ids in self._term_cache.items()
+                if not any(variant in name for name in changed)
+            }
+
+    def recipes_with(self, term):
+        """Sorted ids of recipes having an ingredient that matches the term"""
+        self.ensure_current()
+        variant = ingredient_variant(term)
+        ids = self._term_cache.get(variant)
+        if ids is None:
+            with self._lock:
+                matches = [posting for name, posting in self._postings.items() if variant in name]
+                ids = np.unique(np.concatenate(matches)) if matches else EMPTY_IDS
+                if len(self._term_cache) >= TERM_CACHE_SIZE:
+                    self._term_cache = {}
+                self._term_cache[variant] = ids
+        return ids
+
+    def recipes_with_all(self, terms):
+        """Sorted ids of recipes matching every term"""
+        postings = sorted((self.recipes_with(term) for term in terms), key=len)
+        if not postings:
+            return EMPTY_IDS
+        result = postings[0]
+        for posting in postings[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, posting, assume_unique=True)
+        return result
+
+
+class DietaryTagIndex(CatalogIndex):
+    """
+    One packed bitmap per dietary tag over the sorted array of recipe ids.
+
+    Every tag in DietaryPreferenceForm.DIETARY_CHOICES gets a bitmap, as does
+    any other tag found on a recipe, so "recipes satisfying all of these
+    preferences" is a bitwise AND of a handful of small arrays.
+    """
+    generation_key = 'dietary_index_generation'
+    artifact_name = 'dietary_index'
+
+    def __init__(self):
+        super().__init__()
+        self._ids = EMPTY_IDS
+        self._present = np.empty(0, dtype=np.uint8)
+        self._bitmaps = {}
+
+    def rebuild(self):
+        rows = list(Recipe.objects.order_by('recipe_id').values_list('recipe_id', 'dietary_tags'))
+        tags = {choice for choice, _ in DietaryPreferenceForm.DIETARY_CHOICES}
+        for _, recipe_tags in rows:
+            tags.update(recipe_tags or [])
+
+        bits = {tag: np.zeros(len(rows), dtype=bool) for tag in tags}
+        for position, (_, recipe_tags) in enumerate(rows):
+            for tag in recipe_tags or []:
+                bits[tag][position] = True
+
+        self._ids = np.array([recipe_id for recipe_id, _ in rows], dtype=np.int64)
+        self._present = np.packbits(np.ones(len(rows), dtype=bool))
+        self._bitmaps = {tag: np.packbits(tag_bits) for tag, tag_bits in bits.items()}
+
+    def dump_arrays(self):
+        tags = sorted(self._bitmaps)
+        return {
+            'recipe_ids': self._ids,
+            'present': self._present,
+            'tags': np.array(tags, dtype=str),
+            'bitmaps': np.array([self._bitmaps[tag] for tag in tags], dtype=np.uint8).reshape(len(tags), len(self._present)),
+        }
+
+    def load_arrays(self, arrays):
+        # Copied rather than mapped: the bitmaps are small and updated in place
+        self._ids = np.array(arrays['recipe_ids'])
+        self._present = np.array(arrays['present'])
+        self._bitmaps = {
+            tag: np.array(bitmap)
+            for tag, bitmap in zip(arrays['tags'].tolist(), arrays['bitmaps'])
+        }
+
+    def _set_bits(self, position, tags, present=True):
+        byte, bit = divmod(int(position), 8)
+        flag = np.uint8(0x80 >> bit)
+        for tag in set(self._bitmaps) | tags:
+            bitmap = self._bitmaps.get(tag)
+            if bitmap is None:
+                bitmap = self._bitmaps[tag] = np.zeros(len(self._present), dtype=np.uint8)
+            if tag in tags:
+                bitmap[byte] |= flag
+            else:
+                bitmap[byte] &= ~flag
+        if present:
+            self._present[byte] |= flag
+        else:
+            self._present[byte] &= ~flag
+
+    def update_recipe(self, recipe_id, tags):
+        """Set one recipe's bits from its current dietary tags"""
+        if not self._built:
+            return
+        with self._lock:
+            position = np.searchsorted(self._ids, recipe_id)
+            if position == len(self._ids) or self._ids[position] != recipe_id:
+                if position != len(self._ids):
+                    # Ids are only ever appended in practice; anything else rebuilds
+                    self._built = False
+                    return
+                self._ids = np.append(self._ids, recipe_id)
+                if len(self._present) * 8 < len(self._ids):
+                    self._present = np.append(self._present, np.uint8(0))
+                    self._bitmaps = {
+                        tag: np.append(bitmap, np.uint8(0))
+                        for tag, bitmap in self._bitmaps.items()
+                    }
+            self._set_bits(position, set(tags or []))
+
+    def remove_recipe(self, recipe_id):
+        """Clear a deleted recipe's bits"""
+        if not self._built:
+            return
+        with self._lock:
+            position = np.searchsorted(self._ids, recipe_id)
+            if position < len(self._ids) and self._ids[position] == recipe_id:
+                self._set_bits(position, set(), present=False)
+
+    def recipe_ids_matching(self, preferences):
+        """Sorted ids of recipes tagged with every one of the preferences"""
+        self.ensure_current()
+        with self._lock:
+            mask = self._present
+            for preference in preferences:
+                bitmap = self._bitmaps.get(preference)
+                if bitmap is None:
+                    return EMPTY_IDS
+                mask = mask & bitmap
+            return self._ids[np.flatnonzero(np.unpackbits(mask, count=len(self._ids)))]
+
+
+class RecipeIngredientMatrix(CatalogIndex):
+    """
+    Sparse recipe x ingredient incidence matrix (CSR, one row per recipe that
+    has ingredients, one column per Ingredient row).
+
+    A user's ingredient strings are resolved to a 0/1 column vector once, after
+    which match and missing counts for every recipe come from one mat-vec.
+    Invalidated (and rebuilt lazily) whenever recipe ingredients change.
+    """
+    generation_key = 'ingredient_matrix_generation'
+    artifact_name = 'ingredient_matrix'
+
+    def __init__(self):
+        super().__init__()
+        self.matrix = csr_matrix((0, 0), dtype=np.int32)
+        self.recipe_ids = EMPTY_IDS
+        self.column_names = []
+        self._columns = np.empty(0, dtype=np.int32)
+        self._resolved = {}
+
+    def rebuild(self):
+        ingredient_ids = []
+        column_names = []
+        for ingredient_id, name in Ingredient.objects.order_by('ingredient_id').values_list('ingredient_id', 'name'):
+            ingredient_ids.append(ingredient_id)
+            column_names.append(name.lower())
+        column_of = {ingredient_id: column for column, ingredient_id in enumerate(ingredient_ids)}
+
+        # Rows keep the order recipe ingredients are listed in
+        recipe_ids, columns, indptr = [], [], [0]
+        rows = (
+            RecipeIngredient.objects.order_by('recipe_id', 'id')
+            .values_list('recipe_id', 'ingredient_id').iterator()
+        )
+        for recipe_id, ingredient_id in rows:
+            if not recipe_ids or recipe_ids[-1] != recipe_id:
+                if recipe_ids:
+                    indptr.append(len(columns))
+                recipe_ids.append(recipe_id)
+            columns.append(column_of[ingredient_id])
+        if recipe_ids:
+            indptr.append(len(columns))
+
+        self._set_arrays(
+            np.array(columns, dtype=np.int32),
+            np.array(indptr, dtype=np.int64),
+            np.array(recipe_ids, dtype=np.int64),
+            column_names,
+        )
+
+    def _set_arrays(self, columns, indptr, recipe_ids, column_names):
+        self._columns = columns
+        self.matrix = csr_matrix(
+            (np.ones(len(columns), dtype=np.int32), np.array(columns), indptr),
+            shape=(len(recipe_ids), len(column_names)),
+        )
+        self.recipe_ids = recipe_ids
+        self.column_names = column_names
+        self._resolved = {}
+
+    def dump_arrays(self):
+        return {
+            'columns': self._columns,
+            'indptr': self.matrix.indptr,
+            'recipe_ids': self.recipe_ids,
+            'column_names': np.array(self.column_names, dtype=str),
+        }
+
+    def load_arrays(self, arrays):
+        self._set_arrays(
+            arrays['columns'],
+            arrays['indptr'],
+            arrays['recipe_ids'],
+            arrays['column_names'].tolist(),
+        )
+
+    def _resolve(self, user_ingredients):
+        """Boolean column mask of ingredients matched by any of the user's strings"""
+        mask = np.zeros(len(self.column_names), dtype=bool)
+        for user_ingredient in set(user_ingredients):
+            columns = self._resolved.get(user_ingredient)
+            if columns is None:
+                columns = np.array([
+                    column for column, name in enumerate(self.column_names)
+                    if ingredient_matches(name, user_ingredient)
+                ], dtype=np.int64)
+                if len(self._resolved) >= TERM_CACHE_SIZE:
+                    self._resolved = {}
+                self._resolved[user_ingredient] = columns
+            mask[columns] = True
+        return mask
+
+    def almost_matching(self, user_ingredients, max_missing, limit, allowed_ids=None):
+        """
+        Rank recipes that use some of the user's ingredients and miss at most
+        max_missing others. Ties keep recipe id order.
+        """
+        self.ensure_current()
+        if not user_ingredients:
+            return []
+        with self._lock:
+            matched = self._resolve(user_ingredients)
+            match_counts = self.matrix @ matched.astype(np.int32)
+            totals = np.diff(self.matrix.indptr)
+            missing_counts = totals - match_counts
+
+            eligible = (
+                (totals <= len(user_ingredients) * 2)
+                & (match_counts > 0)
+                & (missing_counts <= max_missing)
+            )
+            if allowed_ids is not None:
+                eligible &= np.isin(self.recipe_ids, allowed_ids)
+            rows = np.flatnonzero(eligible)
+
+            match_ratio = match_counts[rows] / totals[rows]
+            ingredient_utilization = match_counts[rows] / len(user_ingredients)
+            # Score recipes higher when they use more of user's ingredients
+            # and have fewer missing ingredients
+            relevance = (match_ratio * 3) + (ingredient_utilization * 2) - (0.1 * missing_counts[rows])
+            order = np.argsort(-relevance, kind='stable')[:limit]
+
+            results = []
+            for position in order:
+                row = rows[position]
+                start, end = self.matrix.indptr[row], self.matrix.indptr[row + 1]
+                columns = self._columns[start:end]
+                results.append({
+                    'recipe_id': int(self.recipe_ids[row]),
+                    'missing_ingredients': [self.column_names[c] for c in columns if not matched[c]],
+                    'matching_ingredients': [self.column_names[c] for c in columns if matched[c]],
+                    'missing_count': int(missing_counts[row]),
+                    'match_count': int(match_counts[row]),
+                    'match_ratio': float(match_ratio[position]),
+                    'ingredient_utilization': float(ingredient_utilization[position]),
+                    'relevance_score': float(relevance[position]),
+                })
+            return results
+
+
+ingredient_index = IngredientIndex()
+dietary_index = DietaryTagIndex()
+ingredient_matrix = RecipeIngredientMatrix()
@@ -0,0 +1,119 @@
+"""
+Buffered recording of RecipeInteraction events.
+
+Views call record_interaction() instead of RecipeInteraction.objects.create(),
+so viewing a recipe doesn't write to the database on the request path. Events
+are kept in memory per process and written with bulk_create by a background
+thread once FLUSH_SIZE events are pending or every FLUSH_INTERVAL seconds,
+and once more when the process exits.
+"""
+import atexit
+import logging
+import os
+import threading
+
+from django.db import connections, transaction, IntegrityError
+from django.utils import timezone
+
+from recommendations.models import RecipeInteraction
+from recommendations.recommendation_engine import invalidate_user_recommendations
+from recommendations.scores import record_interaction_scores
+from recommendations import popularity
+
+logger = logging.getLogger(__name__)
+
+# Pending events that trigger an early flush
+FLUSH_SIZE = 200
+
+# Longest time (in seconds) an event waits before being written
+FLUSH_INTERVAL = 2.0
+
+
+class InteractionBuffer:
+    def __init__(self, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = []
+        self._thread = None
+        self._pid = None
+
+    def record(self, user_id, recipe_id, interaction_type):
+        with self._lock:
+            self._ensure_flusher()
+            self._pending.append((user_id, recipe_id, interaction_type, timezone.now()))
+            full = len(self._pending) >= self.flush_size
+        if full:
+            self._wakeup.set()
+
+    def _ensure_flusher(self):
+        if self._pid != os.getpid():
+            # Forked: events buffered in the parent are the parent's to write
+            if self._pid is None:
+                atexit.register(self.flush)
+            self._pid = os.getpid()
+            self._pending = []
+            self._thread = None
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='interaction-buffer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                if self.flush():
+                    # Don't hold a connection open between flushes
+                    connections.close_all()
+            except Exception:
+                logger.exception('Failed to write buffered recipe interactions')
+
+    def flush(self):
+        """Write all pending events now; returns how many were written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+
+            interactions = [
+                RecipeInteraction(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    interaction_type=interaction_type,
+                    timestamp=timestamp
+                )
+                for user_id, recipe_id, interaction_type, timestamp in pending
+            ]
+            try:
+                with transaction.atomic():
+                    RecipeInteraction.objects.bulk_create(interactions, batch_size=self.flush_size)
+                    # bulk_create skips post_save, so do its work here
+                    record_interaction_scores(interactions)
+                    popularity.record_interactions(interactions)
+            except IntegrityError:
+                # A recipe or user was deleted in the meantime; save the rest
+                # one by one (post_save then updates scores and caches)
+                written = 0
+                for interaction in interactions:
+                    try:
+                        interaction.save()
+                        written += 1
+                    except IntegrityError:
+                        pass
+                return written
+
+            for user_id in {interaction.user_id for interaction in interactions}:
+                invalidate_user_recommendations(user_id)
+            return len(interactions)
+
+
+interaction_buffer = InteractionBuffer()
+
+
+def record_interaction(user, recipe, interaction_type):
+    """Queue a user's interaction with a recipe to be written shortly"""
+    interaction_buffer.record(user.id, recipe.pk, interaction_type)
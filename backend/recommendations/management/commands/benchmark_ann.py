@@ -0,0 +1,60 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from recommendations.ann import get_ann_index
+from recommendations.text_utils import load_recipe_vectors
+
+
+class Command(BaseCommand):
+    help = 'Measure recall and latency of the ANN index against exact TF-IDF cosine similarity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=200,
+                            help='Number of recipes queried')
+        parser.add_argument('--k', type=int, default=10,
+                            help='Neighbours compared per query')
+        parser.add_argument('--probes', default='1,4,8,16,32',
+                            help='Comma-separated probe counts to try')
+        parser.add_argument('--candidates', default='0,50,100,200',
+                            help='Comma-separated candidate counts re-ranked exactly (0: no re-ranking)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        vectors = load_recipe_vectors()
+        ann_index = get_ann_index()
+        if vectors is None or ann_index is None:
+            raise CommandError('Build the index first: manage.py build_recommendation_index --ann')
+        tfidf_matrix, recipe_ids, vectorizer = vectors
+        k = options['k']
+
+        rng = np.random.default_rng(options['seed'])
+        sample = rng.choice(len(recipe_ids), size=min(options['sample'], len(recipe_ids)), replace=False)
+
+        # Exact neighbours by scanning the whole TF-IDF matrix
+        exact = {}
+        started = time.perf_counter()
+        for row in sample:
+            similarities = (tfidf_matrix[row] @ tfidf_matrix.T).toarray().ravel()
+            similarities[row] = -np.inf
+            top = np.argpartition(-similarities, k - 1)[:k]
+            exact[row] = {recipe_ids[i] for i in top}
+        exact_ms = (time.perf_counter() - started) / len(sample) * 1000
+        self.stdout.write(f'exact scan: {exact_ms:.3f} ms/query over {len(recipe_ids)} recipes')
+
+        for probes in (int(p) for p in options['probes'].split(',')):
+            for candidates in (int(c) for c in options['candidates'].split(',')):
+                found = 0
+                started = time.perf_counter()
+                for row in sample:
+                    neighbors = ann_index.neighbors(
+                        recipe_ids[row], k, probes=probes, candidates=candidates,
+                        tfidf_matrix=tfidf_matrix if candidates else None
+                    ) or []
+                    found += len(exact[row].intersection(neighbors))
+                elapsed_ms = (time.perf_counter() - started) / len(sample) * 1000
+                self.stdout.write(
+                    f'probes={probes:<4} candidates={candidates:<5} '
+                    f'recall@{k}={found / (len(sample) * k):.3f}  {elapsed_ms:.3f} ms/query'
+                )
@@ -0,0 +1,82 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from recommendations import artifacts
+from recommendations.ann import ANN_ARTIFACT, ANN_DIMENSIONS, build_ann_index, save_ann_index
+from recommendations.indexes import ingredient_index, dietary_index, ingredient_matrix
+from recommendations.neighbors import NEIGHBOR_ARTIFACT, NEIGHBOR_TABLE_K, build_neighbor_table, save_neighbor_table
+from recommendations.text_utils import TFIDF_ARTIFACT, build_recipe_vectors, save_recipe_vectors
+
+
+class Command(BaseCommand):
+    help = 'Build the TF-IDF matrix, neighbour table and catalog indexes used by recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--neighbors', type=int, default=NEIGHBOR_TABLE_K,
+                            help='Number of similar recipes stored per recipe (0 to skip the table)')
+        parser.add_argument('--ann', action='store_true',
+                            help='Also build the approximate nearest-neighbour index (for large catalogs)')
+        parser.add_argument('--ann-dimensions', type=int, default=ANN_DIMENSIONS,
+                            help='Dimensions the ANN index reduces TF-IDF vectors to')
+        parser.add_argument('--ann-lists', type=int, default=None,
+                            help='Inverted lists in the ANN index (default: sqrt of the catalog size)')
+
+    def handle(self, *args, **options):
+        self.build = f'{time.strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        self.stages = {}
+        self.stdout.write(f'Building recommendation index {self.build}...')
+        started = time.perf_counter()
+
+        tfidf_matrix, recipe_ids, vectorizer = self._stage(
+            'tfidf', TFIDF_ARTIFACT, self._build_tfidf
+        )
+        self._stage(
+            'neighbors', NEIGHBOR_ARTIFACT,
+            lambda: save_neighbor_table(
+                build_neighbor_table(tfidf_matrix, recipe_ids, k=options['neighbors']),
+                build=self.build,
+            )
+        )
+        if options['ann']:
+            self._stage(
+                'ann', ANN_ARTIFACT,
+                lambda: save_ann_index(
+                    build_ann_index(
+                        tfidf_matrix, recipe_ids,
+                        dimensions=options['ann_dimensions'], lists=options['ann_lists'],
+                    ),
+                    build=self.build,
+                )
+            )
+        for index in (ingredient_index, ingredient_matrix, dietary_index):
+            self._stage(
+                index.artifact_name, index.artifact_name,
+                lambda index=index: index.build_artifact(build=self.build)
+            )
+
+        artifacts.record_build(self.build, self.stages)
+        self.stdout.write(self.style.SUCCESS(
+            f'Recommendation index {self.build} built in {time.perf_counter() - started:.2f}s '
+            f'({len(recipe_ids)} recipes)'
+        ))
+
+    def _build_tfidf(self):
+        tfidf_matrix, recipe_ids, vectorizer = build_recipe_vectors()
+        save_recipe_vectors(tfidf_matrix, recipe_ids, vectorizer, build=self.build)
+        return tfidf_matrix, recipe_ids, vectorizer
+
+    def _stage(self, stage, artifact_name, build):
+        """Run one build step and report how long it took and its size on disk"""
+        started = time.perf_counter()
+        result = build()
+        elapsed = time.perf_counter() - started
+        size = artifacts.artifact_size(artifact_name)
+        self.stages[stage] = {
+            'seconds': round(elapsed, 3),
+            'bytes': size,
+            'version': artifacts.artifact_version(artifact_name),
+        }
+        self.stdout.write(f'  {stage}: {elapsed:.2f}s, {size / 1024:.1f} KiB')
+        return result
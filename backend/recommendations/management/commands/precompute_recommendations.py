@@ -0,0 +1,68 @@
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from recommendations.neighbors import get_neighbor_table
+from recommendations.precompute import (
+    ACTIVE_USER_DAYS, PRECOMPUTED_RESULTS, active_user_ids, compute_recommendations, save_recommendations
+)
+from recommendations.text_utils import load_recipe_vectors
+
+# Users handed to a worker at a time
+CHUNK_SIZE = 50
+
+
+def _compute_chunk(args):
+    user_ids, max_results = args
+    try:
+        return compute_recommendations(user_ids, max_results)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Precompute recommendations for recently active users; run periodically, e.g. every few hours'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ACTIVE_USER_DAYS,
+                            help='Include users active within this many days')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes')
+        parser.add_argument('--limit', type=int, default=PRECOMPUTED_RESULTS,
+                            help='Recommendations stored per user')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        user_ids = active_user_ids(options['days'])
+        chunks = [
+            (user_ids[start:start + CHUNK_SIZE], options['limit'])
+            for start in range(0, len(user_ids), CHUNK_SIZE)
+        ]
+        workers = min(options['workers'], len(chunks))
+
+        # Open the TF-IDF and neighbour artifacts before forking so every
+        # worker shares the same read-only memory maps
+        load_recipe_vectors()
+        get_neighbor_table()
+
+        saved = 0
+        if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            # Children must open their own database connections
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                for rows in pool.imap_unordered(_compute_chunk, chunks):
+                    save_recommendations(rows)
+                    saved += len(rows)
+        else:
+            for chunk in chunks:
+                rows = compute_recommendations(*chunk)
+                save_recommendations(rows)
+                saved += len(rows)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Precomputed recommendations for {saved} users '
+            f'({options["days"]}-day window, {max(workers, 1)} workers) in {time.perf_counter() - started:.2f}s'
+        ))
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recommendations.popularity import refresh_popularity, POPULARITY_WINDOW
+
+
+class Command(BaseCommand):
+    help = 'Recompute recipe popularity (saves and recent interactions); run periodically, e.g. hourly'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = refresh_popularity()
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed popularity of {count} recipes '
+            f'({POPULARITY_WINDOW.days}-day window) in {time.perf_counter() - started:.2f}s'
+        ))
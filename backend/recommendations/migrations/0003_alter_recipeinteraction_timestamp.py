@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 01:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommendations', '0002_recipeinteraction'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipeinteraction',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
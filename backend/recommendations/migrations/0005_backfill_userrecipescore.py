@@ -0,0 +1,62 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+from django.db import migrations
+
+# Snapshot of recommendations.scores at the time of this migration
+INTERACTION_WEIGHTS = {'favorite': 5.0, 'cook': 3.0, 'view': 1.0}
+SCORE_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+DECAY_RATE = math.log(2) / timedelta(days=30).total_seconds()
+
+
+def _logaddexp(a, b):
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def backfill_scores(apps, schema_editor):
+    RecipeInteraction = apps.get_model('recommendations', 'RecipeInteraction')
+    UserRecipeScore = apps.get_model('recommendations', 'UserRecipeScore')
+
+    scores = {}
+    interactions = RecipeInteraction.objects.values_list(
+        'user_id', 'recipe_id', 'interaction_type', 'timestamp'
+    ).iterator(chunk_size=2000)
+    for user_id, recipe_id, interaction_type, timestamp in interactions:
+        contribution = (
+            math.log(INTERACTION_WEIGHTS.get(interaction_type, 1.0))
+            + DECAY_RATE * (timestamp - SCORE_EPOCH).total_seconds()
+        )
+        log_score, last_interaction = scores.get((user_id, recipe_id), (None, timestamp))
+        scores[(user_id, recipe_id)] = (
+            contribution if log_score is None else _logaddexp(log_score, contribution),
+            max(last_interaction, timestamp),
+        )
+
+    UserRecipeScore.objects.bulk_create(
+        [
+            UserRecipeScore(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                log_score=log_score,
+                last_interaction=last_interaction
+            )
+            for (user_id, recipe_id), (log_score, last_interaction) in scores.items()
+        ],
+        batch_size=1000,
+    )
+
+
+def clear_scores(apps, schema_editor):
+    apps.get_model('recommendations', 'UserRecipeScore').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommendations', '0004_userrecipescore'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_scores, clear_scores),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.15 on 2026-10-18 01:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_search_index'),
+        ('recommendations', '0005_backfill_userrecipescore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipePopularity',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='recipes.recipe')),
+                ('save_count', models.IntegerField(default=0)),
+                ('recent_interactions', models.IntegerField(default=0)),
+                ('score', models.FloatField(default=0.0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-score'], name='recommendat_score_b1c15e_idx')],
+            },
+        ),
+    ]
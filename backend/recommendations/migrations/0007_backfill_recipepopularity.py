@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from django.db import migrations
+from django.db.models import Count
+from django.utils import timezone
+
+# Snapshot of recommendations.popularity at the time of this migration
+POPULARITY_WINDOW = timedelta(days=14)
+SAVE_WEIGHT = 4.0
+
+
+def backfill_popularity(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    SavedRecipe = apps.get_model('recipes', 'SavedRecipe')
+    RecipeInteraction = apps.get_model('recommendations', 'RecipeInteraction')
+    RecipePopularity = apps.get_model('recommendations', 'RecipePopularity')
+
+    save_counts = dict(
+        SavedRecipe.objects.values('recipe_id').annotate(count=Count('saved_recipe_id'))
+        .values_list('recipe_id', 'count')
+    )
+    recent_counts = dict(
+        RecipeInteraction.objects.filter(timestamp__gte=timezone.now() - POPULARITY_WINDOW)
+        .values('recipe_id').annotate(count=Count('id'))
+        .values_list('recipe_id', 'count')
+    )
+    RecipePopularity.objects.bulk_create(
+        [
+            RecipePopularity(
+                recipe_id=recipe_id,
+                save_count=save_counts.get(recipe_id, 0),
+                recent_interactions=recent_counts.get(recipe_id, 0),
+                score=SAVE_WEIGHT * save_counts.get(recipe_id, 0) + recent_counts.get(recipe_id, 0)
+            )
+            for recipe_id in Recipe.objects.values_list('recipe_id', flat=True)
+        ],
+        batch_size=1000,
+    )
+
+
+def clear_popularity(apps, schema_editor):
+    apps.get_model('recommendations', 'RecipePopularity').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_search_index'),
+        ('recommendations', '0006_recipepopularity'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_popularity, clear_popularity),
+    ]
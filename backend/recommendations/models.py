@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 # Create your models here.
 
@@ -34,7 +35,8 @@ class RecipeInteraction(models.Model):
         related_name="user_interactions"
     )
     interaction_type = models.CharField(max_length=20, choices=INTERACTION_TYPES)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the interaction happens, not when a buffered batch is written
+    timestamp = models.DateTimeField(default=timezone.now)
     
     class Meta:
         indexes = [
@@ -44,3 +46,76 @@ class RecipeInteraction(models.Model):
     
     def __str__(self):
         return f"{self.user.username} {self.interaction_type} {self.recipe.title}"
+
+class UserRecipeScore(models.Model):
+    """
+    A user's time-decayed interaction score for a recipe, updated as
+    interactions are recorded (see recommendations.scores)
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="recipe_scores"
+    )
+    recipe = models.ForeignKey(
+        'recipes.Recipe',
+        on_delete=models.CASCADE,
+        related_name="user_scores"
+    )
+    # Natural log of the score as of scores.SCORE_EPOCH; ordering by it
+    # orders by the current decayed score
+    log_score = models.FloatField()
+    last_interaction = models.DateTimeField()
+    
+    class Meta:
+        unique_together = (("user", "recipe"),)
+        indexes = [
+            models.Index(fields=['user', '-log_score']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} -> {self.recipe.title}: {self.log_score:.3f}"
+
+class RecipePopularity(models.Model):
+    """
+    Save and recent interaction counts per recipe, kept up to date as recipes
+    are saved and interactions recorded (see recommendations.popularity)
+    """
+    recipe = models.OneToOneField(
+        'recipes.Recipe',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="popularity"
+    )
+    save_count = models.IntegerField(default=0)
+    recent_interactions = models.IntegerField(default=0)
+    score = models.FloatField(default=0.0)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score']),
+        ]
+    
+    def __str__(self):
+        return f"{self.recipe.title}: {self.score}"
+
+class UserRecommendation(models.Model):
+    """
+    Recommendations computed ahead of time by the precompute_recommendations
+    command (see recommendations.precompute)
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="precomputed_recommendations"
+    )
+    recipe_ids = models.JSONField(default=list)
+    max_results = models.IntegerField()
+    # When the computation started; anything the user did after that may be missing
+    computed_at = models.DateTimeField()
+    # Last change to the user's data, kept across recomputations
+    invalidated_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.user.username}: {len(self.recipe_ids)} recipes at {self.computed_at}"
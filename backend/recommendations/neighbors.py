@@ -0,0 +1,104 @@
+"""
+Precomputed top-K similarity neighbours for every recipe.
+
+The table is built offline from the TF-IDF matrix a block of rows at a time,
+so peak memory stays bounded regardless of catalog size, and is persisted as
+compact NumPy arrays. Looking up similar recipes is then an array slice.
+"""
+import threading
+
+import numpy as np
+
+from recommendations import artifacts
+
+NEIGHBOR_ARTIFACT = 'neighbors'
+
+# Number of neighbours stored per recipe
+NEIGHBOR_TABLE_K = 50
+
+# Upper bound on the dense similarity block held in memory while building
+NEIGHBOR_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def build_neighbor_table(tfidf_matrix, recipe_ids, k=NEIGHBOR_TABLE_K, block_bytes=NEIGHBOR_BLOCK_BYTES):
+    """
+    Compute the k most similar recipes (and their cosine scores) for every row.
+
+    TfidfVectorizer rows are L2-normalised, so a sparse dot product is the
+    cosine similarity. Rows are processed in blocks sized to fit block_bytes.
+    """
+    n = tfidf_matrix.shape[0]
+    k = max(0, min(k, n - 1))
+    ids = np.asarray(recipe_ids, dtype=np.int32)
+    neighbor_ids = np.zeros((n, k), dtype=np.int32)
+    neighbor_scores = np.zeros((n, k), dtype=np.float32)
+
+    if k:
+        transposed = tfidf_matrix.T.tocsc()
+        block_size = max(1, block_bytes // (n * 8))
+        for start in range(0, n, block_size):
+            end = min(start + block_size, n)
+            similarities = (tfidf_matrix[start:end] @ transposed).toarray()
+            # A recipe is never its own neighbour
+            similarities[np.arange(end - start), np.arange(start, end)] = -np.inf
+
+            top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(similarities, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+
+            neighbor_ids[start:end] = ids[top]
+            neighbor_scores[start:end] = np.take_along_axis(top_scores, order, axis=1)
+
+    return {
+        'recipe_ids': ids,
+        'neighbor_ids': neighbor_ids,
+        'neighbor_scores': neighbor_scores,
+    }
+
+
+class NeighborTable:
+    """Read-only view over a persisted neighbour table"""
+
+    def __init__(self, arrays):
+        self.recipe_ids = arrays['recipe_ids']
+        self.neighbor_ids = arrays['neighbor_ids']
+        self.neighbor_scores = arrays['neighbor_scores']
+        self.k = self.neighbor_ids.shape[1]
+        self._rows = {int(recipe_id): row for row, recipe_id in enumerate(self.recipe_ids)}
+
+    def neighbors(self, recipe_id, top_n):
+        """Ids of the top_n most similar recipes, or None if the table can't answer"""
+        row = self._rows.get(recipe_id)
+        if row is None or top_n > self.k:
+            return None
+        return self.neighbor_ids[row, :top_n].tolist()
+
+    def scored_neighbors(self, recipe_id, top_n):
+        """(id, cosine similarity) of the top_n most similar recipes, or None"""
+        row = self._rows.get(recipe_id)
+        if row is None or top_n > self.k:
+            return None
+        return list(zip(self.neighbor_ids[row, :top_n].tolist(), self.neighbor_scores[row, :top_n].tolist()))
+
+
+def save_neighbor_table(table, build=None):
+    return artifacts.save_artifact(
+        NEIGHBOR_ARTIFACT, table, metadata={'k': table['neighbor_ids'].shape[1], 'build': build}
+    )
+
+
+_loaded = {'version': None, 'table': None}
+_load_lock = threading.Lock()
+
+
+def get_neighbor_table():
+    """The persisted neighbour table, reloaded when a new version is written"""
+    version = artifacts.artifact_version(NEIGHBOR_ARTIFACT)
+    if version != _loaded['version']:
+        with _load_lock:
+            if version != _loaded['version']:
+                loaded = artifacts.load_artifact(NEIGHBOR_ARTIFACT)
+                _loaded['table'] = NeighborTable(loaded[1]) if loaded else None
+                _loaded['version'] = loaded[0]['version'] if loaded else version
+    return _loaded['table']
@@ -0,0 +1,133 @@
+"""
+Candidate generation and ranking for personalized recommendations.
+
+A candidate generator is a function taking a CandidateContext and returning
+(recipe_id, score) pairs, best first; register one with
+@candidate_generator(name, weight). rank_candidates() runs every registered
+generator concurrently on a shared thread pool and waits at most the latency
+budget: a generator that hasn't finished by then is dropped from this ranking
+(it keeps running in the background, typically warming its caches) instead of
+holding up the response. Each generator's scores are divided by its best
+score, multiplied by its weight and summed per recipe. Callers are told which
+generators were dropped (late or failed), so a partial ranking isn't cached
+as long as a complete one.
+"""
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# Seconds rank_candidates waits for generators unless
+# settings.RECOMMENDATION_PIPELINE_BUDGET says otherwise
+PIPELINE_BUDGET = 0.25
+
+# Threads shared by all requests running generators
+PIPELINE_WORKERS = 16
+
+# Passed to generators: the user, how many candidates to return, the user's
+# dietary preferences and the ids of the recipes meeting them (None when the
+# user has no preferences)
+CandidateContext = namedtuple('CandidateContext', ['user', 'limit', 'preferences', 'allowed_ids'])
+
+# rank_candidates() budget meaning "the configured budget"
+DEFAULT_BUDGET = object()
+
+_generators = {}
+
+_executor = {'pid': None, 'pool': None}
+_executor_lock = threading.Lock()
+
+
+def candidate_generator(name, weight=1.0):
+    """Register a candidate generator under name, its normalized scores scaled by weight"""
+    def register(generate):
+        _generators[name] = (generate, weight)
+        return generate
+    return register
+
+
+def _get_executor():
+    # A pool inherited through fork has no threads behind it; start a new one
+    if _executor['pid'] != os.getpid():
+        with _executor_lock:
+            if _executor['pid'] != os.getpid():
+                _executor['pool'] = ThreadPoolExecutor(
+                    max_workers=PIPELINE_WORKERS, thread_name_prefix='candidates'
+                )
+                _executor['pid'] = os.getpid()
+    return _executor['pool']
+
+
+def _run_generator(generate, context):
+    # Pool threads outlive requests, so manage their connections like a request would
+    close_old_connections()
+    try:
+        return generate(context)
+    finally:
+        close_old_connections()
+
+
+def run_candidate_generators(context, budget=PIPELINE_BUDGET):
+    """
+    Run all generators. Returns {name: [(recipe_id, score), ...]} for the
+    ones that finished within budget seconds (budget=None waits for all),
+    and the names of the ones dropped for running late or failing.
+    """
+    started = time.perf_counter()
+    executor = _get_executor()
+    futures = {
+        executor.submit(_run_generator, generate, context): name
+        for name, (generate, _) in _generators.items()
+    }
+    done, pending = wait(futures, timeout=budget)
+
+    results = {}
+    dropped = []
+    for future in done:
+        name = futures[future]
+        try:
+            results[name] = future.result()
+        except Exception:
+            logger.exception('Candidate generator %s failed', name)
+            dropped.append(name)
+    for future in pending:
+        future.cancel()
+        logger.warning(
+            'Candidate generator %s missed the %.0f ms budget; ranking without it',
+            futures[future], budget * 1000
+        )
+        dropped.append(futures[future])
+    logger.debug('Candidate generators finished in %.1f ms', (time.perf_counter() - started) * 1000)
+    return results, sorted(dropped)
+
+
+def merge_candidates(results):
+    """Sum weighted, max-normalized scores per recipe; (recipe_id, score) pairs, best first"""
+    merged = {}
+    for name, candidates in results.items():
+        weight = _generators[name][1]
+        best = max((score for _, score in candidates), default=0)
+        if best <= 0:
+            continue
+        for recipe_id, score in candidates:
+            if score > 0:
+                merged[recipe_id] = merged.get(recipe_id, 0) + weight * score / best
+    return sorted(merged.items(), key=lambda item: (-item[1], item[0]))
+
+
+def rank_candidates(context, budget=DEFAULT_BUDGET):
+    """
+    Ranked candidates from every generator that finishes within the budget
+    (None: no limit), and the names of the generators dropped
+    """
+    if budget is DEFAULT_BUDGET:
+        budget = getattr(settings, 'RECOMMENDATION_PIPELINE_BUDGET', PIPELINE_BUDGET)
+    results, dropped = run_candidate_generators(context, budget)
+    return merge_candidates(results), dropped
@@ -0,0 +1,135 @@
+"""
+Recipe popularity ranking.
+
+RecipePopularity holds each recipe's save count and number of interactions
+in the last POPULARITY_WINDOW. Saves and recorded interactions adjust the
+counts in place; the refresh_popularity command, run hourly by the cron job
+in render.yaml, recomputes them from scratch so that interactions age out of
+the window and any drift is corrected.
+
+Readers never aggregate the saves table: the ranking is a cached array of
+recipe IDs ordered by score, filtered with the dietary tag index when needed.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction, IntegrityError
+from django.db.models import Count, F
+from django.utils import timezone
+
+from cuisine_craft_project.cache import get_or_compute
+from recipes.models import Recipe, SavedRecipe
+from recommendations.indexes import dietary_index
+from recommendations.models import RecipeInteraction, RecipePopularity
+
+# Interactions older than this no longer count towards popularity
+POPULARITY_WINDOW = timedelta(days=14)
+
+# A save counts as much as this many recent interactions
+SAVE_WEIGHT = 4.0
+
+POPULARITY_RANKING_KEY = 'recipe_popularity_ranking'
+POPULARITY_RANKING_TTL = 5 * 60  # 5 minutes
+POPULARITY_RANKING_STALE_TTL = 60 * 60  # 1 hour
+
+
+def _adjust(recipe_id, save_delta=0, interaction_delta=0):
+    score_delta = SAVE_WEIGHT * save_delta + interaction_delta
+    updated = RecipePopularity.objects.filter(recipe_id=recipe_id).update(
+        save_count=F('save_count') + save_delta,
+        recent_interactions=F('recent_interactions') + interaction_delta,
+        score=F('score') + score_delta
+    )
+    if not updated:
+        try:
+            with transaction.atomic():
+                RecipePopularity.objects.create(
+                    recipe_id=recipe_id,
+                    save_count=max(save_delta, 0),
+                    recent_interactions=max(interaction_delta, 0),
+                    score=max(score_delta, 0)
+                )
+        except IntegrityError:
+            # Created concurrently, or the recipe is gone
+            if RecipePopularity.objects.filter(recipe_id=recipe_id).exists():
+                _adjust(recipe_id, save_delta, interaction_delta)
+
+
+def record_save(recipe_id, delta):
+    """Count a recipe being saved (delta=1) or unsaved (delta=-1)"""
+    _adjust(recipe_id, save_delta=delta)
+
+
+def record_interactions(interactions):
+    """Count newly recorded interactions towards their recipes' popularity"""
+    counts = {}
+    for interaction in interactions:
+        counts[interaction.recipe_id] = counts.get(interaction.recipe_id, 0) + 1
+    for recipe_id, count in counts.items():
+        _adjust(recipe_id, interaction_delta=count)
+
+
+def refresh_popularity():
+    """Recompute every recipe's counts; returns the number of recipes"""
+    save_counts = dict(
+        SavedRecipe.objects.values('recipe_id').annotate(count=Count('saved_recipe_id'))
+        .values_list('recipe_id', 'count')
+    )
+    recent_counts = dict(
+        RecipeInteraction.objects.filter(timestamp__gte=timezone.now() - POPULARITY_WINDOW)
+        .values('recipe_id').annotate(count=Count('id'))
+        .values_list('recipe_id', 'count')
+    )
+    rows = [
+        RecipePopularity(
+            recipe_id=recipe_id,
+            save_count=save_counts.get(recipe_id, 0),
+            recent_interactions=recent_counts.get(recipe_id, 0),
+            score=SAVE_WEIGHT * save_counts.get(recipe_id, 0) + recent_counts.get(recipe_id, 0)
+        )
+        for recipe_id in Recipe.objects.values_list('recipe_id', flat=True).iterator()
+    ]
+    with transaction.atomic():
+        RecipePopularity.objects.bulk_create(
+            rows,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['recipe'],
+            update_fields=['save_count', 'recent_interactions', 'score']
+        )
+    invalidate_ranking()
+    return len(rows)
+
+
+def invalidate_ranking():
+    """Drop the cached ranking, e.g. after recipes were added or removed"""
+    cache.delete(POPULARITY_RANKING_KEY)
+
+
+def _rank_recipes():
+    # Recipes without a popularity row yet (e.g. just imported) rank last
+    ranked = Recipe.objects.order_by(
+        F('popularity__score').desc(nulls_last=True), 'recipe_id'
+    ).values_list('recipe_id', flat=True)
+    return np.fromiter(ranked.iterator(), dtype=np.int64)
+
+
+def popular_recipe_ids(limit=None, preferences=None, exclude=()):
+    """
+    Recipe IDs, most popular first.
+    
+    preferences restricts the ranking to recipes carrying every tag (via the
+    dietary bitmaps) and exclude drops the given IDs.
+    """
+    ranked = get_or_compute(
+        POPULARITY_RANKING_KEY,
+        _rank_recipes,
+        POPULARITY_RANKING_TTL,
+        POPULARITY_RANKING_STALE_TTL
+    )
+    if preferences:
+        ranked = ranked[np.isin(ranked, dietary_index.recipe_ids_matching(preferences), assume_unique=True)]
+    if exclude:
+        ranked = ranked[~np.isin(ranked, np.fromiter(exclude, dtype=np.int64))]
+    return ranked[:limit].tolist()
@@ -0,0 +1,85 @@
+"""
+Precomputed recommendations.
+
+The precompute_recommendations command computes the recommendations of
+every recently active user ahead of time and stores the recipe IDs in
+UserRecommendation. RecommendedRecipesView serves a stored row instead of
+computing live while it is fresh: younger than PRECOMPUTED_MAX_AGE, and
+computed after the user's preferences or saved recipes last changed
+(invalidate_user_recommendations stamps invalidated_at on the row). New
+interactions don't invalidate the row; they shift the ranking gradually, so
+PRECOMPUTED_MAX_AGE bounds how far it lags behind them.
+"""
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.utils import timezone
+
+from recommendations.models import RecipeInteraction, UserRecommendation
+from recommendations.recommendation_engine import rank_personalized_recommendations
+
+# Number of recommendations stored per user (the recommended view's default limit)
+PRECOMPUTED_RESULTS = 12
+
+# Stored recommendations older than this are recomputed live
+PRECOMPUTED_MAX_AGE = timedelta(hours=6)
+
+# Users whose last interaction or login is older than this are skipped
+ACTIVE_USER_DAYS = 30
+
+
+def active_user_ids(days=ACTIVE_USER_DAYS):
+    """IDs of users who logged in or interacted with a recipe in the last days"""
+    cutoff = timezone.now() - timedelta(days=days)
+    interacted = RecipeInteraction.objects.filter(timestamp__gte=cutoff).values('user_id')
+    return list(
+        get_user_model().objects.filter(Q(last_login__gte=cutoff) | Q(pk__in=interacted))
+        .order_by('pk').values_list('pk', flat=True)
+    )
+
+
+def compute_recommendations(user_ids, max_results=PRECOMPUTED_RESULTS):
+    """Compute recommendations for the given users; returns unsaved UserRecommendation rows"""
+    users = get_user_model().objects.in_bulk(user_ids)
+    rows = []
+    for user_id in user_ids:
+        user = users.get(user_id)
+        if user is None:
+            continue
+        # Taken before computing so a change made meanwhile marks the row stale
+        computed_at = timezone.now()
+        rows.append(UserRecommendation(
+            user_id=user_id,
+            # Batch runs can afford to wait for every generator
+            recipe_ids=rank_personalized_recommendations(user, max_results, budget=None).recipe_ids,
+            max_results=max_results,
+            computed_at=computed_at
+        ))
+    return rows
+
+
+def save_recommendations(rows):
+    """Insert or replace stored recommendations, keeping invalidated_at"""
+    UserRecommendation.objects.bulk_create(
+        rows,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['recipe_ids', 'max_results', 'computed_at']
+    )
+
+
+def precomputed_recommendation_ids(user_id, max_results):
+    """The user's stored recommendations if they are fresh, otherwise None"""
+    row = UserRecommendation.objects.filter(
+        user_id=user_id,
+        max_results=max_results,
+        computed_at__gte=timezone.now() - PRECOMPUTED_MAX_AGE
+    ).values_list('recipe_ids', 'computed_at', 'invalidated_at').first()
+    if row is None:
+        return None
+    recipe_ids, computed_at, invalidated_at = row
+    if invalidated_at is not None and invalidated_at >= computed_at:
+        return None
+    return recipe_ids
@@ -1,263 +1,188 @@
+import logging
+import time
+from collections import namedtuple
 import numpy as np
-from django.db.models import Count, Q, F, ExpressionWrapper, fields, Sum
+from django.db.models import Q, F, ExpressionWrapper, fields, Sum
 from django.utils import timezone
 from datetime import timedelta
 from django.core.cache import cache
-from recommendations.text_utils import find_similar_recipes
-from recipes.models import Recipe, SavedRecipe, RecipeIngredient
-from recommendations.models import RecipeInteraction, DietaryPreference
+from cuisine_craft_project.cache import ShortLived, get_or_compute
+from recipes.search import ranked_recipes
+from recommendations.popularity import popular_recipe_ids
+from recommendations.scores import INTERACTION_WEIGHTS, top_recipe_scores
+from recommendations.text_utils import find_similar_recipe_scores, find_profile_recipe_scores
+from recommendations.indexes import dietary_index, ingredient_matrix
+from recommendations.pipeline import CandidateContext, DEFAULT_BUDGET, candidate_generator, rank_candidates
+from recipes.models import Recipe, SavedRecipe
+from ingredients.models import UserIngredient
+from recommendations.models import DietaryPreference, UserRecommendation
+
+logger = logging.getLogger(__name__)
 
 # Cache TTLs (in seconds)
 USER_RECOMMENDATIONS_TTL = 30 * 60  # 30 minutes
-USER_FAVORITES_TTL = 60 * 60  # 1 hour
+DEGRADED_RECOMMENDATIONS_TTL = 30  # a ranking some candidate generators missed
 USER_PREFERENCES_TTL = 3 * 60 * 60  # 3 hours
 
+# How long an expired entry is still served while it is recomputed in the
+# background (changes to the user's own data bump their cache version, so
+# this only ever serves results that aged out, never invalidated ones)
+STALE_WHILE_REVALIDATE_TTL = 10 * 60  # 10 minutes
+
+# Recipes read from the user's interaction scores
+WEIGHTED_INTERACTIONS_TOP_K = 20
+
+# Most ingredients a pantry candidate may need beyond the user's own
+PANTRY_MAX_MISSING = 2
+
+# A user's recommended recipe IDs and the candidate generators left out of
+# their ranking (empty when it is complete)
+RankedRecommendations = namedtuple('RankedRecommendations', ['recipe_ids', 'dropped'])
+
+def user_cache_version(user_id):
+    """
+    Current generation of a user's cached recommendation data.
+    
+    Every per-user key embeds this number, so bumping it (see
+    invalidate_user_recommendations) orphans all of the user's entries at
+    once on any cache backend; they simply age out. A missing counter starts
+    from the current time rather than 1 so an evicted counter can't bring
+    back entries from an earlier generation.
+    """
+    version_key = f'user_cache_version:{user_id}'
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, time.time_ns(), None)
+        version = cache.get(version_key)
+    return version
+
+def user_cache_key(name, user_id, *parts):
+    """Cache key for per-user data, scoped to the user's current cache version"""
+    return ':'.join([name, str(user_id), f'v{user_cache_version(user_id)}', *map(str, parts)])
+
 def get_user_dietary_preferences(user):
     """Get user's dietary preferences with caching"""
     if not user.is_authenticated:
         return []
     
-    # Try to get from cache
-    cache_key = f'user_preferences_{user.id}'
-    cached_preferences = cache.get(cache_key)
-    
-    if cached_preferences is not None:
-        return cached_preferences
+    def load_preferences():
+        preferences = DietaryPreference.objects.filter(user=user).values_list('restriction_type', flat=True)
+        return list(preferences)
     
-    # Not in cache, get from database
-    preferences = DietaryPreference.objects.filter(user=user).values_list('restriction_type', flat=True)
-    preferences_list = list(preferences)
-    
-    # Cache the result
-    cache.set(cache_key, preferences_list, USER_PREFERENCES_TTL)
-    
-    return preferences_list
+    return get_or_compute(
+        user_cache_key('user_preferences', user.id),
+        load_preferences,
+        USER_PREFERENCES_TTL,
+        STALE_WHILE_REVALIDATE_TTL
+    )
 
 def filter_by_dietary_preferences(recipes_queryset, preferences):
-    """Filter recipes by dietary preferences more efficiently"""
+    """Filter recipes by dietary preferences using the shared dietary tag index"""
     if not preferences:
         return recipes_queryset
     
-    # Instead of processing in batches, use more efficient filtering
-    matching_recipes = []
-    
-    # Use select_related to reduce database queries
-    for recipe in recipes_queryset.iterator():
-        if all(pref in recipe.dietary_tags for pref in preferences):
-            matching_recipes.append(recipe.recipe_id)
+    # Bitwise AND of the per-tag bitmaps gives the eligible recipe IDs
+    matching_recipes = dietary_index.recipe_ids_matching(preferences)
     
     # Return filtered queryset based on collected IDs
-    if matching_recipes:
-        return recipes_queryset.filter(recipe_id__in=matching_recipes)
+    if len(matching_recipes):
+        return recipes_queryset.filter(recipe_id__in=matching_recipes.tolist())
     else:
         return Recipe.objects.none()
 
-def get_user_favorite_ingredients(user, top_n=5):
-    """Get user's most frequently favorited ingredients with caching"""
-    if not user.is_authenticated:
-        return []
-    
-    # Try to get from cache
-    cache_key = f'user_favorite_ingredients_{user.id}'
-    cached_ingredients = cache.get(cache_key)
-    
-    if cached_ingredients is not None:
-        return cached_ingredients
-    
-    # Get ingredients from user's saved recipes
-    favorite_recipe_ids = SavedRecipe.objects.filter(user=user).values_list('recipe_id', flat=True)
-    
-    if not favorite_recipe_ids:
-        return []
-    
-    # Get most common ingredients in favorited recipes
-    favorite_ingredients = (
-        RecipeIngredient.objects.filter(recipe_id__in=favorite_recipe_ids)
-        .values('ingredient_id')
-        .annotate(count=Count('ingredient_id'))
-        .order_by('-count')[:top_n]
-        .values_list('ingredient_id', flat=True)
-    )
-    
-    result = list(favorite_ingredients)
-    
-    # Cache the result
-    cache.set(cache_key, result, USER_FAVORITES_TTL)
-    
-    return result
+def candidate_context(user, limit):
+    """Context for running candidate generators for a user"""
+    preferences = get_user_dietary_preferences(user)
+    allowed_ids = dietary_index.recipe_ids_matching(preferences) if preferences else None
+    return CandidateContext(user, limit, preferences, allowed_ids)
 
-def get_content_based_recommendations(user, max_results=10):
-    """Get content-based recommendations using text similarity and user preferences"""
-    if not user.is_authenticated:
-        return Recipe.objects.none()
-    
-    # Try to get from cache
-    cache_key = f'content_recommendations_{user.id}_{max_results}'
-    cached_recommendations = cache.get(cache_key)
-    
-    if cached_recommendations is not None:
-        return Recipe.objects.filter(recipe_id__in=cached_recommendations)
-    
+def _top_candidates(recipe_scores, context):
+    """Best context.limit of {recipe_id: score} meeting the user's preferences"""
+    if context.allowed_ids is not None:
+        allowed = set(context.allowed_ids.tolist())
+        recipe_scores = {recipe_id: score for recipe_id, score in recipe_scores.items() if recipe_id in allowed}
+    return sorted(recipe_scores.items(), key=lambda item: (-item[1], item[0]))[:context.limit]
+
+@candidate_generator('content')
+def content_candidates(context):
+    """Recipes closest to the user's taste profile, scored by cosine similarity"""
     # Get user's favorite recipes
-    favorite_recipe_ids = list(SavedRecipe.objects.filter(user=user).values_list('recipe_id', flat=True))
+    favorite_recipe_ids = list(SavedRecipe.objects.filter(user=context.user).values_list('recipe_id', flat=True))
     
-    if not favorite_recipe_ids:
-        # If no favorites, return popular recipes
-        popular_recipes = Recipe.objects.annotate(
-            save_count=Count('saved_instances')
-        ).order_by('-save_count')[:max_results]
-        
-        # Cache even the fallback results
-        cache.set(
-            cache_key, 
-            [recipe.recipe_id for recipe in popular_recipes], 
-            USER_RECOMMENDATIONS_TTL
-        )
-        
-        return popular_recipes
+    # The user's profile: favorites plus recently interacted recipes,
+    # weighted by their interaction scores
+    profile = {recipe_id: INTERACTION_WEIGHTS['favorite'] for recipe_id in favorite_recipe_ids}
+    for recipe_id, score in get_weighted_user_interactions(context.user).items():
+        profile[recipe_id] = profile.get(recipe_id, 0) + score
     
-    # Get content-based recommendations from each favorite recipe
-    recommended_recipe_ids = set()
+    if not profile:
+        return []
     
-    # Limit the number of favorites we process to avoid too much processing
+    # Score the whole catalog against the profile centroid in one go
+    candidates = find_profile_recipe_scores(profile, top_n=context.limit, allowed_ids=context.allowed_ids)
+    if candidates is not None:
+        return candidates
+    
+    # No TF-IDF model built yet: use the neighbours of a few favorites
+    recipe_scores = {}
     for recipe_id in favorite_recipe_ids[:5]:  # Process at most 5 favorites
-        similar_recipes = find_similar_recipes(recipe_id, top_n=3)
-        recommended_recipe_ids.update(similar_recipes)
+        for similar_id, similarity in find_similar_recipe_scores(recipe_id, top_n=3):
+            recipe_scores[similar_id] = max(recipe_scores.get(similar_id, 0), similarity)
     
     # Remove recipes the user has already favorited
-    recommended_recipe_ids = recommended_recipe_ids - set(favorite_recipe_ids)
-    
-    # Get the actual recipe objects
-    recommended_recipes = Recipe.objects.filter(recipe_id__in=recommended_recipe_ids)
+    for recipe_id in favorite_recipe_ids:
+        recipe_scores.pop(recipe_id, None)
     
-    # Get user's dietary preferences
-    preferences = get_user_dietary_preferences(user)
-    
-    # Filter by dietary preferences
-    if preferences:
-        recommended_recipes = filter_by_dietary_preferences(recommended_recipes, preferences)
-    
-    # Store the recipe IDs in cache
-    result_recipes = list(recommended_recipes[:max_results])
-    result_ids = [recipe.recipe_id for recipe in result_recipes]
-    cache.set(cache_key, result_ids, USER_RECOMMENDATIONS_TTL)
-    
-    # Limit to max_results
-    return recommended_recipes[:max_results]
+    return _top_candidates(recipe_scores, context)
 
-def get_recent_interactions(user, interaction_type='view', limit=5):
-    """Get user's recent recipe interactions of a specific type"""
-    if not user.is_authenticated:
+@candidate_generator('popularity', weight=0.25)
+def popularity_candidates(context):
+    """The most popular recipes meeting the user's preferences, scored by rank"""
+    recipe_ids = popular_recipe_ids(limit=context.limit, preferences=context.preferences)
+    return [(recipe_id, (len(recipe_ids) - rank) / len(recipe_ids)) for rank, recipe_id in enumerate(recipe_ids)]
+
+@candidate_generator('pantry', weight=0.75)
+def pantry_candidates(context):
+    """Recipes the user can (nearly) make from their tracked ingredients, scored by relevance"""
+    pantry = [
+        name.lower() for name in
+        UserIngredient.objects.filter(user=context.user).values_list('ingredient__name', flat=True)
+    ]
+    if not pantry:
         return []
-    
-    cache_key = f'user_interactions_{user.id}_{interaction_type}_{limit}'
-    cached_interactions = cache.get(cache_key)
-    
-    if cached_interactions is not None:
-        return cached_interactions
-    
-    recent_interactions = RecipeInteraction.objects.filter(
-        user=user, 
-        interaction_type=interaction_type
-    ).order_by('-timestamp')[:limit]
-    
-    result = [interaction.recipe_id for interaction in recent_interactions]
-    
-    # Cache for a shorter period since interactions change frequently
-    cache.set(cache_key, result, 15 * 60)  # 15 minutes
-    
-    return result
+    matches = ingredient_matrix.almost_matching(
+        pantry, PANTRY_MAX_MISSING, context.limit, allowed_ids=context.allowed_ids
+    )
+    return [(match['recipe_id'], match['relevance_score']) for match in matches]
 
-def get_weighted_user_interactions(user, days_limit=30):
+def get_weighted_user_interactions(user, days_limit=30, top_k=WEIGHTED_INTERACTIONS_TOP_K):
     """
-    Get user interactions weighted by type and recency
+    Get the user's top recipes by interaction score, weighted by type and recency
     
     Weights:
     - favorite: 5.0
     - cook: 3.0
     - view: 1.0
     
-    Also applies time decay - more recent interactions have higher weight
+    Scores decay exponentially with age and are maintained incrementally as
+    interactions are recorded (see recommendations.scores), so this reads
+    top_k rows however long the user's history is. Recipes the user hasn't
+    interacted with in days_limit days are left out.
     """
     if not user.is_authenticated:
         return {}
     
-    cache_key = f'weighted_interactions_{user.id}_{days_limit}'
-    cached_scores = cache.get(cache_key)
-    
-    if cached_scores is not None:
-        return cached_scores
-    
-    # Define the cutoff date for recent interactions
     cutoff_date = timezone.now() - timedelta(days=days_limit)
-    
-    # Get all user interactions within the time period
-    interactions = RecipeInteraction.objects.filter(
-        user=user,
-        timestamp__gte=cutoff_date
-    ).values('recipe_id', 'interaction_type', 'timestamp')
-    
-    # Define weights for different interaction types
-    interaction_weights = {
-        'favorite': 5.0,
-        'cook': 3.0,
-        'view': 1.0
-    }
-    
-    # Calculate weighted score for each recipe
-    recipe_scores = {}
-    
-    for interaction in interactions:
-        recipe_id = interaction['recipe_id']
-        interaction_type = interaction['interaction_type']
-        
-        # Calculate days since interaction (for time decay)
-        days_old = (timezone.now() - interaction['timestamp']).days
-        time_factor = max(0, (days_limit - days_old) / days_limit)
-        
-        # Calculate score for this interaction
-        weight = interaction_weights.get(interaction_type, 1.0)
-        score = weight * (0.5 + 0.5 * time_factor)  # Base weight + recency boost
-        
-        # Add to recipe's total score
-        if recipe_id in recipe_scores:
-            recipe_scores[recipe_id] += score
-        else:
-            recipe_scores[recipe_id] = score
-    
-    # Cache the results
-    cache.set(cache_key, recipe_scores, 30 * 60)  # 30 minutes
-    
-    return recipe_scores
+    return top_recipe_scores(user.id, top_k, since=cutoff_date)
 
-def get_interaction_based_recommendations(user, max_results=10):
-    """Get recommendations based on all user interactions, not just favorites"""
-    if not user.is_authenticated:
-        return Recipe.objects.none()
-    
-    cache_key = f'interaction_recommendations_{user.id}_{max_results}'
-    cached_recommendations = cache.get(cache_key)
-    
-    if cached_recommendations is not None:
-        return Recipe.objects.filter(recipe_id__in=cached_recommendations)
-    
+@candidate_generator('interaction')
+def interaction_candidates(context):
+    """
+    The user's top interacted recipes and their nearest neighbours, scored by
+    interaction score (times similarity for the neighbours)
+    """
     # Get weighted interaction scores
-    recipe_scores = get_weighted_user_interactions(user)
-    
-    if not recipe_scores:
-        # If no interactions, return popular recipes
-        popular_recipes = Recipe.objects.annotate(
-            save_count=Count('saved_instances')
-        ).order_by('-save_count')[:max_results]
-        
-        # Cache the fallback results too
-        cache.set(
-            cache_key, 
-            [recipe.recipe_id for recipe in popular_recipes], 
-            USER_RECOMMENDATIONS_TTL
-        )
-        
-        return popular_recipes
+    recipe_scores = get_weighted_user_interactions(context.user)
     
     # Sort recipes by score and take top N for finding similar recipes
     top_interacted_recipes = sorted(
@@ -266,38 +191,21 @@ def get_interaction_based_recommendations(user, max_results=10):
         reverse=True
     )[:5]  # Consider top 5 interacted recipes
     
+    # The top interacted recipes themselves are potential recommendations too
+    candidate_scores = dict(top_interacted_recipes)
+    
     # Find similar recipes for each top interacted recipe
-    recommended_recipe_ids = set()
-    for recipe_id, _ in top_interacted_recipes:
+    for recipe_id, score in top_interacted_recipes:
         try:
-            similar_recipes = find_similar_recipes(recipe_id, top_n=3)
-            recommended_recipe_ids.update(similar_recipes)
-        except Exception as e:
+            similar_recipes = find_similar_recipe_scores(recipe_id, top_n=3)
+        except Exception:
             # Log the error but continue with other recipes
-            print(f"Error finding similar recipes for {recipe_id}: {str(e)}")
+            logger.exception('Error finding similar recipes for %s', recipe_id)
             continue
+        for similar_id, similarity in similar_recipes:
+            candidate_scores[similar_id] = candidate_scores.get(similar_id, 0) + score * similarity
     
-    # Add the top interacted recipes themselves as potential recommendations
-    for recipe_id, _ in top_interacted_recipes:
-        recommended_recipe_ids.add(recipe_id)
-    
-    # Get user's dietary preferences
-    preferences = get_user_dietary_preferences(user)
-    
-    # Get the actual recipe objects - limit before expensive filtering
-    recommended_recipes = Recipe.objects.filter(recipe_id__in=recommended_recipe_ids)
-    
-    # Filter by dietary preferences
-    if preferences:
-        recommended_recipes = filter_by_dietary_preferences(recommended_recipes, preferences)
-    
-    # Cache the results
-    result_recipes = list(recommended_recipes[:max_results])
-    result_ids = [recipe.recipe_id for recipe in result_recipes]
-    cache.set(cache_key, result_ids, USER_RECOMMENDATIONS_TTL)
-    
-    # Limit to max_results
-    return recommended_recipes[:max_results]
+    return _top_candidates(candidate_scores, context)
 
 def add_diversity(recipes, max_results=12):
     """Ensure diversity in recommendation results"""
@@ -337,85 +245,75 @@ def add_diversity(recipes, max_results=12):
     
     return final_recommendations
 
-def get_personalized_recommendations(user, max_results=12):
-    """Get personalized recipe recommendations using multiple strategies with caching"""
-    # Try to get from cache first
-    cache_key = f'personalized_recommendations_{user.id}_{max_results}'
-    cached_recommendations = cache.get(cache_key)
-    
-    if cached_recommendations is not None:
-        return Recipe.objects.filter(recipe_id__in=cached_recommendations)
-    
-    # Get recommendations from different sources
-    interaction_recs = list(get_interaction_based_recommendations(user, max_results=max_results//2))
-    content_recs = list(get_content_based_recommendations(user, max_results=max_results//2))
-    
-    # Combine results (removing duplicates)
-    all_recs = []
-    seen_ids = set()
+def rank_personalized_recommendations(user, max_results=12, budget=DEFAULT_BUDGET):
+    """
+    Compute a user's personalized recommendations without the result cache:
+    every candidate generator runs concurrently within the latency budget
+    (None waits for all of them) and candidates are ranked by their combined
+    normalized scores. Returns RankedRecommendations.
+    """
+    context = candidate_context(user, max_results)
+    ranked, dropped = rank_candidates(context, budget)
+    recipe_ids = [recipe_id for recipe_id, _ in ranked[:max_results]]
+    
+    # Top up from the popularity ranking if generators came back short
+    if len(recipe_ids) < max_results:
+        recipe_ids += popular_recipe_ids(
+            limit=max_results - len(recipe_ids),
+            preferences=context.preferences,
+            exclude=set(recipe_ids)
+        )
     
-    # Alternate between recommendation sources for diversity
-    for i in range(max(len(interaction_recs), len(content_recs))):
-        if i < len(interaction_recs) and interaction_recs[i].recipe_id not in seen_ids:
-            all_recs.append(interaction_recs[i])
-            seen_ids.add(interaction_recs[i].recipe_id)
-            
-        if i < len(content_recs) and content_recs[i].recipe_id not in seen_ids:
-            all_recs.append(content_recs[i])
-            seen_ids.add(content_recs[i].recipe_id)
-            
-        if len(all_recs) >= max_results:
-            break
-    
-    # Add popular recipes if needed
-    if len(all_recs) < max_results:
-        # Get user's dietary preferences
-        preferences = get_user_dietary_preferences(user)
-        
-        # Get popular recipes
-        popular_recipes = Recipe.objects.annotate(
-            save_count=Count('saved_instances')
-        ).order_by('-save_count')
-        
-        # Filter by dietary preferences
-        if preferences:
-            popular_recipes = filter_by_dietary_preferences(popular_recipes, preferences)
-        
-        # Filter out recipes we already have
-        for recipe in popular_recipes:
-            if recipe.recipe_id not in seen_ids and len(all_recs) < max_results:
-                all_recs.append(recipe)
-                seen_ids.add(recipe.recipe_id)
+    recipes = Recipe.objects.in_bulk(recipe_ids)
+    all_recs = [recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes]
     
     # Add diversity to final recommendations
     all_recs = add_diversity(all_recs, max_results)
     
-    # Cache the final recommendations
-    final_recs = all_recs[:max_results]
-    cache.set(
-        cache_key, 
-        [recipe.recipe_id for recipe in final_recs], 
-        USER_RECOMMENDATIONS_TTL
+    return RankedRecommendations([recipe.recipe_id for recipe in all_recs[:max_results]], dropped)
+
+def get_ranked_recommendations(user, max_results=12):
+    """RankedRecommendations for the user, with caching"""
+    def rank():
+        ranking = rank_personalized_recommendations(user, max_results)
+        if ranking.dropped:
+            # Partial ranking: keep it only until a complete one can replace it
+            return ShortLived(ranking, DEGRADED_RECOMMENDATIONS_TTL)
+        return ranking
+    
+    # Only the final ranking (recipe IDs) is cached
+    return get_or_compute(
+        user_cache_key('ranked_recommendations', user.id, max_results),
+        rank,
+        USER_RECOMMENDATIONS_TTL,
+        STALE_WHILE_REVALIDATE_TTL
     )
-    
-    return final_recs
+
+def get_personalized_recommendation_ids(user, max_results=12):
+    """Get personalized recommendations as recipe IDs, with caching"""
+    return get_ranked_recommendations(user, max_results).recipe_ids
+
+def get_personalized_recommendations(user, max_results=12):
+    """Get personalized recipe recommendations using multiple strategies with caching"""
+    return ranked_recipes(get_personalized_recommendation_ids(user, max_results))
 
 # Function to invalidate all recommendation caches for a user
-def invalidate_user_recommendations(user_id):
-    """Invalidate all recommendation caches for a specific user"""
-    pattern_list = [
-        f'user_preferences_{user_id}',
-        f'user_favorite_ingredients_{user_id}',
-        f'content_recommendations_{user_id}_',
-        f'interaction_recommendations_{user_id}_',
-        f'personalized_recommendations_{user_id}_',
-        f'weighted_interactions_{user_id}_',
-        f'user_interactions_{user_id}_'
-    ]
-    
-    for pattern in pattern_list:
-        # In a real implementation, you would use cache.delete_pattern or similar
-        # For Django's default cache, you might need to implement this differently
-        cache.delete(pattern)
+def invalidate_user_recommendations(user_id, stored=False):
+    """
+    Invalidate all recommendation caches for a specific user. With stored,
+    also mark their precomputed recommendations stale: done for changes to
+    preferences or saved recipes, while the drift from new interactions is
+    left to PRECOMPUTED_MAX_AGE.
+    """
+    version_key = f'user_cache_version:{user_id}'
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        # Counter was evicted; any fresh value differs from the old one
+        cache.set(version_key, time.time_ns(), None)
+    
+    if stored:
+        # Precomputed recommendations from before now are out of date too
+        UserRecommendation.objects.filter(user_id=user_id).update(invalidated_at=timezone.now())
         
-    return True
\ No newline at end of file
+    return True
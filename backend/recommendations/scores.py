@@ -0,0 +1,123 @@
+"""
+Incrementally maintained, exponentially decayed interaction scores.
+
+A user's score for a recipe is the sum over their interactions of
+
+    weight * 2 ** -(age / SCORE_HALF_LIFE)
+
+Because every term decays at the same rate, the sum can be kept as a single
+number anchored at a fixed epoch and decayed lazily when read:
+
+    log_score = log(sum(weight * exp(DECAY_RATE * (t - SCORE_EPOCH))))
+    score(now) = exp(log_score - DECAY_RATE * (now - SCORE_EPOCH))
+
+Recording an interaction is a logaddexp into one UserRecipeScore row, and the
+top recipes for a user are an indexed ORDER BY log_score, however long their
+history is. Scores are stored as logs so they never overflow.
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from recommendations.models import UserRecipeScore
+
+# Weights for different interaction types
+INTERACTION_WEIGHTS = {
+    'favorite': 5.0,
+    'cook': 3.0,
+    'view': 1.0
+}
+
+# An interaction counts half as much after this long
+SCORE_HALF_LIFE = timedelta(days=30)
+
+# Fixed reference time that stored log scores are expressed at
+SCORE_EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+# Decay per second
+DECAY_RATE = math.log(2) / SCORE_HALF_LIFE.total_seconds()
+
+
+def _elapsed(moment):
+    return (moment - SCORE_EPOCH).total_seconds()
+
+
+def log_contribution(interaction_type, timestamp):
+    """Log of one interaction's weight, expressed at SCORE_EPOCH"""
+    weight = INTERACTION_WEIGHTS.get(interaction_type, 1.0)
+    return math.log(weight) + DECAY_RATE * _elapsed(timestamp)
+
+
+def decayed_score(log_score, now=None):
+    """Current value of a stored log score"""
+    now = now or timezone.now()
+    return math.exp(log_score - DECAY_RATE * _elapsed(now))
+
+
+def record_interaction_scores(interactions):
+    """
+    Fold newly recorded interactions (anything with user_id, recipe_id,
+    interaction_type and timestamp) into the users' recipe scores.
+    """
+    updates = {}
+    for interaction in interactions:
+        key = (interaction.user_id, interaction.recipe_id)
+        contribution = log_contribution(interaction.interaction_type, interaction.timestamp)
+        log_score, last_interaction = updates.get(key, (-math.inf, interaction.timestamp))
+        updates[key] = (
+            float(np.logaddexp(log_score, contribution)),
+            max(last_interaction, interaction.timestamp),
+        )
+    if not updates:
+        return
+
+    try:
+        _apply_score_updates(updates)
+    except IntegrityError:
+        # Another process created one of the rows first; the retry updates it
+        _apply_score_updates(updates)
+
+
+def _apply_score_updates(updates):
+    user_ids = {user_id for user_id, _ in updates}
+    recipe_ids = {recipe_id for _, recipe_id in updates}
+    with transaction.atomic():
+        existing = {
+            (score.user_id, score.recipe_id): score
+            for score in UserRecipeScore.objects.select_for_update().filter(
+                user_id__in=user_ids, recipe_id__in=recipe_ids
+            )
+        }
+        changed, created = [], []
+        for (user_id, recipe_id), (log_score, last_interaction) in updates.items():
+            score = existing.get((user_id, recipe_id))
+            if score is None:
+                created.append(UserRecipeScore(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    log_score=log_score,
+                    last_interaction=last_interaction
+                ))
+            else:
+                score.log_score = float(np.logaddexp(score.log_score, log_score))
+                score.last_interaction = max(score.last_interaction, last_interaction)
+                changed.append(score)
+        if changed:
+            UserRecipeScore.objects.bulk_update(changed, ['log_score', 'last_interaction'])
+        if created:
+            UserRecipeScore.objects.bulk_create(created)
+
+
+def top_recipe_scores(user_id, top_k, since=None):
+    """The user's top_k recipes by current score, as {recipe_id: score}, best first"""
+    scores = UserRecipeScore.objects.filter(user_id=user_id)
+    if since is not None:
+        scores = scores.filter(last_interaction__gte=since)
+    now = timezone.now()
+    return {
+        recipe_id: decayed_score(log_score, now)
+        for recipe_id, log_score in scores.order_by('-log_score').values_list('recipe_id', 'log_score')[:top_k]
+    }
@@ -0,0 +1,113 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from recipes.models import Recipe, RecipeIngredient, SavedRecipe
+from ingredients.models import Ingredient
+from cuisine_craft_project.transactions import CommitBatch
+from recipes.dietary import retag_on_commit
+from recommendations.indexes import ingredient_index, dietary_index, ingredient_matrix
+from recommendations.models import RecipeInteraction, DietaryPreference
+from recommendations.recommendation_engine import invalidate_user_recommendations
+from recommendations.scores import record_interaction_scores
+from recommendations import popularity
+
+
+# Queued when an ingredient is renamed, which can move any recipe in the index
+_ALL_RECIPES = None
+
+
+def _apply_ingredient_changes(recipe_ids):
+    if _ALL_RECIPES in recipe_ids:
+        ingredient_index.invalidate()
+    else:
+        for recipe_id in recipe_ids:
+            ingredient_index.update_recipe(recipe_id)
+        ingredient_index.publish_change()
+    ingredient_matrix.invalidate()
+
+
+# Recipes whose ingredients changed, applied together once the transaction
+# commits so the ingredient matrix is rebuilt once rather than once per row
+_ingredient_changes = CommitBatch(_apply_ingredient_changes)
+
+
+def _refresh_recipe_tags(recipe_id, tags):
+    dietary_index.update_recipe(recipe_id, tags)
+    dietary_index.publish_change()
+
+
+def _remove_recipe_tags(recipe_id):
+    dietary_index.remove_recipe(recipe_id)
+    dietary_index.publish_change()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, **kwargs):
+    """
+    Classify a new recipe with the dietary rules, which also indexes it, or
+    update an existing recipe's bits in the dietary index, once committed
+    """
+    if created:
+        retag_on_commit(instance.recipe_id)
+        return
+    recipe_id, tags = instance.recipe_id, list(instance.dietary_tags or [])
+    transaction.on_commit(lambda: _refresh_recipe_tags(recipe_id, tags))
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    recipe_id = instance.recipe_id
+    transaction.on_commit(lambda: _remove_recipe_tags(recipe_id))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    """Patch the ingredient index (and invalidate the matrix) and retag the recipe once committed"""
+    _ingredient_changes.add(instance.recipe_id)
+    retag_on_commit(instance.recipe_id)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_renamed(sender, instance, created, **kwargs):
+    """A renamed ingredient can move many recipes, so rebuild from scratch"""
+    if not created:
+        _ingredient_changes.add(_ALL_RECIPES)
+        retag_on_commit(*RecipeIngredient.objects.filter(ingredient=instance).values_list('recipe_id', flat=True))
+
+
+@receiver(post_save, sender=SavedRecipe)
+@receiver(post_delete, sender=SavedRecipe)
+@receiver(post_save, sender=DietaryPreference)
+@receiver(post_delete, sender=DietaryPreference)
+def user_activity_changed(sender, instance, **kwargs):
+    """Drop the user's cached and precomputed recommendations once the change is committed"""
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_user_recommendations(user_id, stored=True))
+
+
+@receiver(post_save, sender=RecipeInteraction)
+def interaction_recorded(sender, instance, created, **kwargs):
+    """Fold the interaction into the user's recipe scores once committed"""
+    if created:
+        transaction.on_commit(lambda: _record_interaction(instance))
+
+
+def _record_interaction(interaction):
+    record_interaction_scores([interaction])
+    popularity.record_interactions([interaction])
+    invalidate_user_recommendations(interaction.user_id)
+
+
+@receiver(post_save, sender=SavedRecipe)
+def recipe_favorited(sender, instance, created, **kwargs):
+    if created:
+        recipe_id = instance.recipe_id
+        transaction.on_commit(lambda: popularity.record_save(recipe_id, 1))
+
+
+@receiver(post_delete, sender=SavedRecipe)
+def recipe_unfavorited(sender, instance, **kwargs):
+    recipe_id = instance.recipe_id
+    transaction.on_commit(lambda: popularity.record_save(recipe_id, -1))
@@ -1,21 +1,28 @@
 import re
+import threading
 import numpy as np
 import pickle
 import os
 from django.conf import settings
+from scipy.sparse import csr_matrix
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 from recipes.models import Recipe, RecipeIngredient
+from recommendations import artifacts
+from recommendations.indexes import ingredient_index, dietary_index, ingredient_matrix
+from recommendations.neighbors import get_neighbor_table
+from recommendations.ann import ANN_ARTIFACT, get_ann_index
 from django.db.models import Count
 from django.core.cache import cache
 
-# Cache keys
-TFIDF_MATRIX_CACHE_KEY = 'recipe_tfidf_matrix'
-RECIPE_IDS_CACHE_KEY = 'recipe_ids_for_tfidf'
-VECTORIZER_CACHE_KEY = 'recipe_tfidf_vectorizer'
+# Artifact holding the TF-IDF matrix, its recipe ids and vocabulary
+TFIDF_ARTIFACT = 'tfidf'
 
-# Cache TTL - 24 hours in seconds
-CACHE_TTL = 24 * 60 * 60
+# Vectorizer settings, recorded in the artifact so loads can rebuild it
+TFIDF_PARAMS = {'stop_words': 'english', 'min_df': 2}
+
+# Recipes read per query while streaming the corpus
+CORPUS_BATCH_SIZE = 500
 
 def preprocess_text(text):
     """Clean and normalize text for analysis"""
@@ -27,67 +34,151 @@ def preprocess_text(text):
     text = re.sub(r'\s+', ' ', text).strip()
     return text
 
-def get_recipe_text_features(recipe):
-    """Extract text features from a recipe"""
-    # Get ingredients
-    ingredients = " ".join([ri.ingredient.name for ri in recipe.recipe_ingredients.all()])
-    
-    # Combine with instructions
-    recipe_text = f"{recipe.title} {ingredients} {recipe.instructions}"
-    return preprocess_text(recipe_text)
+def recipe_text_features(title, ingredients, instructions):
+    """Text features from a recipe's title, joined ingredient names and instructions"""
+    return preprocess_text(f"{title} {ingredients} {instructions}")
 
-def build_recipe_text_corpus():
-    """Build corpus of all recipe texts for vectorization"""
-    recipes = Recipe.objects.all()
-    recipe_texts = []
+def iter_recipe_text_corpus(recipe_ids=None, batch_size=CORPUS_BATCH_SIZE):
+    """
+    Stream (recipe_id, text) pairs for all recipes in recipe_id order.
+    
+    Recipes are read in keyset-paginated batches, and each batch's ingredient
+    names come from one joined values_list query, so building the corpus costs
+    two queries per batch and only one batch of rows is held at a time.
+    Pass a list to recipe_ids to have the ids collected as the stream is read.
+    """
+    last_id = 0
+    while True:
+        batch = list(
+            Recipe.objects.filter(recipe_id__gt=last_id)
+            .order_by('recipe_id')
+            .values_list('recipe_id', 'title', 'instructions')[:batch_size]
+        )
+        if not batch:
+            return
+        last_id = batch[-1][0]
+        
+        ingredients = {}
+        rows = (
+            RecipeIngredient.objects.filter(recipe_id__gte=batch[0][0], recipe_id__lte=last_id)
+            .order_by('recipe_id', 'id')
+            .values_list('recipe_id', 'ingredient__name')
+        )
+        for recipe_id, name in rows:
+            ingredients.setdefault(recipe_id, []).append(name)
+        
+        for recipe_id, title, instructions in batch:
+            if recipe_ids is not None:
+                recipe_ids.append(recipe_id)
+            yield recipe_id, recipe_text_features(
+                title, " ".join(ingredients.get(recipe_id, ())), instructions
+            )
+
+def save_recipe_vectors(tfidf_matrix, recipe_ids, vectorizer, build=None):
+    """Persist the TF-IDF model as a memory-mappable artifact"""
+    tfidf_matrix = tfidf_matrix.tocsr()
+    tfidf_matrix.sort_indices()
+    # An ANN index refers to rows of the previous matrix
+    artifacts.remove_artifact(ANN_ARTIFACT)
+    return artifacts.save_artifact(
+        TFIDF_ARTIFACT,
+        {
+            'data': tfidf_matrix.data,
+            'indices': tfidf_matrix.indices,
+            'indptr': tfidf_matrix.indptr,
+            'recipe_ids': np.asarray(recipe_ids, dtype=np.int64),
+            'terms': vectorizer.get_feature_names_out().astype(str),
+            'idf': vectorizer.idf_,
+        },
+        metadata={'shape': list(tfidf_matrix.shape), 'vectorizer': TFIDF_PARAMS, 'build': build},
+    )
+
+_loaded_vectors = {'version': None, 'vectors': None}
+_load_lock = threading.Lock()
+
+def load_recipe_vectors():
+    """
+    Open the persisted TF-IDF model, or return None if it hasn't been built.
+    The matrix is backed directly by the memory-mapped arrays.
+    """
+    version = artifacts.artifact_version(TFIDF_ARTIFACT)
+    if version == _loaded_vectors['version']:
+        return _loaded_vectors['vectors']
+    
+    with _load_lock:
+        if version != _loaded_vectors['version']:
+            vectors = None
+            loaded = artifacts.load_artifact(TFIDF_ARTIFACT)
+            if loaded is not None:
+                manifest, arrays = loaded
+                metadata = manifest['metadata']
+                tfidf_matrix = csr_matrix(
+                    (arrays['data'], arrays['indices'], arrays['indptr']),
+                    shape=tuple(metadata['shape']),
+                    copy=False,
+                )
+                vectorizer = TfidfVectorizer(**metadata['vectorizer'])
+                vectorizer.vocabulary_ = {term: column for column, term in enumerate(arrays['terms'].tolist())}
+                vectorizer.idf_ = np.asarray(arrays['idf'])
+                vectors = (tfidf_matrix, arrays['recipe_ids'].tolist(), vectorizer)
+                version = manifest['version']
+            _loaded_vectors.update(version=version, vectors=vectors)
+    return _loaded_vectors['vectors']
+
+def build_recipe_vectors():
+    """Fit TF-IDF vectors for all recipes from the database"""
+    # The vectorizer reads the corpus in a single pass, so stream it rather
+    # than materialising every recipe's text first
     recipe_ids = []
+    recipe_texts = (text for _, text in iter_recipe_text_corpus(recipe_ids))
     
-    for recipe in recipes:
-        recipe_texts.append(get_recipe_text_features(recipe))
-        recipe_ids.append(recipe.recipe_id)
+    # Create TF-IDF vectors
+    vectorizer = TfidfVectorizer(**TFIDF_PARAMS)
+    tfidf_matrix = vectorizer.fit_transform(recipe_texts)
     
-    return recipe_texts, recipe_ids
+    return tfidf_matrix, recipe_ids, vectorizer
 
 def create_recipe_vectors(force_rebuild=False):
     """
-    Create TF-IDF vectors for all recipes with caching
+    Get the TF-IDF vectors for all recipes.
+    
+    Web requests only ever open the prebuilt artifact (see the
+    build_recommendation_index command) and get None if it doesn't exist;
+    the model is only fitted here when force_rebuild is set.
     """
-    # Try to get cached values
     if not force_rebuild:
-        tfidf_matrix = cache.get(TFIDF_MATRIX_CACHE_KEY)
-        recipe_ids = cache.get(RECIPE_IDS_CACHE_KEY)
-        vectorizer = cache.get(VECTORIZER_CACHE_KEY)
-        
-        if tfidf_matrix is not None and recipe_ids is not None and vectorizer is not None:
-            return tfidf_matrix, recipe_ids, vectorizer
+        return load_recipe_vectors()
     
-    # If not cached or forced rebuild, create new vectors
-    recipe_texts, recipe_ids = build_recipe_text_corpus()
+    tfidf_matrix, recipe_ids, vectorizer = build_recipe_vectors()
     
-    # Create TF-IDF vectors
-    vectorizer = TfidfVectorizer(stop_words='english', min_df=2)
-    tfidf_matrix = vectorizer.fit_transform(recipe_texts)
-    
-    # Cache the results
-    cache.set(TFIDF_MATRIX_CACHE_KEY, tfidf_matrix, CACHE_TTL)
-    cache.set(RECIPE_IDS_CACHE_KEY, recipe_ids, CACHE_TTL)
-    cache.set(VECTORIZER_CACHE_KEY, vectorizer, CACHE_TTL)
+    # Persist for every worker process
+    save_recipe_vectors(tfidf_matrix, recipe_ids, vectorizer)
     
     return tfidf_matrix, recipe_ids, vectorizer
 
-def find_similar_recipes(recipe_id, top_n=5):
-    """Find recipes similar to the given recipe based on text features"""
-    # Use cached vectors if available
-    tfidf_matrix, recipe_ids, vectorizer = create_recipe_vectors()
-    
-    # Check if this recipe's similarity scores are cached
-    similarity_cache_key = f'recipe_similarity_{recipe_id}'
-    cached_similar_ids = cache.get(similarity_cache_key)
+def find_similar_recipe_scores(recipe_id, top_n=5):
+    """Recipes similar to the given recipe by text features, as (recipe_id, cosine similarity) pairs"""
+    # Answer from the precomputed neighbour table when it covers the request
+    neighbor_table = get_neighbor_table()
+    if neighbor_table is not None:
+        similar = neighbor_table.scored_neighbors(recipe_id, top_n)
+        if similar is not None:
+            return similar
+    
+    vectors = create_recipe_vectors()
+    if vectors is None:
+        return []
+    tfidf_matrix, recipe_ids, vectorizer = vectors
     
-    if cached_similar_ids is not None:
-        return cached_similar_ids[:top_n]
+    # Large catalogs may have an approximate index instead of a full table
+    ann_index = get_ann_index()
+    if ann_index is not None:
+        similar = ann_index.scored_neighbors(recipe_id, top_n, tfidf_matrix=tfidf_matrix)
+        if similar is not None:
+            return similar
     
-    # Find index of the target recipe
+    # Fall back to an exact scan (recipe added since the last build, or more
+    # neighbours requested than the table stores)
     try:
         recipe_idx = recipe_ids.index(recipe_id)
     except ValueError:
@@ -97,22 +188,69 @@ def find_similar_recipes(recipe_id, top_n=5):
     cosine_similarities = cosine_similarity(tfidf_matrix[recipe_idx:recipe_idx+1], tfidf_matrix).flatten()
     
     # Get indices of top similar recipes (excluding the recipe itself)
+    cosine_similarities[recipe_idx] = -np.inf
     similar_indices = cosine_similarities.argsort()[:-top_n-1:-1]
     similar_indices = [idx for idx in similar_indices if idx != recipe_idx]
     
     # Get the recipe IDs
-    similar_recipe_ids = [recipe_ids[idx] for idx in similar_indices]
+    return [(recipe_ids[idx], float(cosine_similarities[idx])) for idx in similar_indices]
+
+_row_ids = {'recipe_ids': None, 'array': None}
+
+def _recipe_id_array(recipe_ids):
+    """The loaded model's recipe ids (sorted) as an array, converted once per load"""
+    if _row_ids['recipe_ids'] is not recipe_ids:
+        _row_ids.update(recipe_ids=recipe_ids, array=np.asarray(recipe_ids, dtype=np.int64))
+    return _row_ids['array']
+
+def find_profile_recipe_scores(recipe_weights, top_n=10, allowed_ids=None):
+    """
+    Score the catalog against a user profile: (recipe_id, cosine) pairs, best first.
     
-    # Cache the results (store more than needed for flexibility in later requests)
-    cache.set(similarity_cache_key, similar_recipe_ids, CACHE_TTL)
+    The profile is the weighted centroid of the TF-IDF rows of the recipes in
+    recipe_weights ({recipe_id: weight}); every recipe is scored against it
+    with a single sparse mat-vec. The profile recipes themselves, and recipes
+    not in allowed_ids when it is given, are masked out. Returns None if the
+    TF-IDF model hasn't been built.
+    """
+    vectors = create_recipe_vectors()
+    if vectors is None:
+        return None
+    tfidf_matrix, recipe_ids, vectorizer = vectors
+    row_ids = _recipe_id_array(recipe_ids)
+    
+    # Rows of the profile recipes (recipes added since the build are skipped)
+    profile_ids = np.fromiter(recipe_weights.keys(), dtype=np.int64, count=len(recipe_weights))
+    weights = np.fromiter(recipe_weights.values(), dtype=np.float64, count=len(recipe_weights))
+    rows = np.minimum(np.searchsorted(row_ids, profile_ids), max(len(row_ids) - 1, 0))
+    known = row_ids[rows] == profile_ids if len(row_ids) else np.zeros(len(rows), dtype=bool)
+    if not known.any():
+        return []
     
-    return similar_recipe_ids[:top_n]
-
-# Function to explicitly rebuild the recommendation vectors
-def rebuild_recommendation_vectors():
-    """Force rebuild of all recommendation vectors"""
-    create_recipe_vectors(force_rebuild=True)
-    return True
+    # Weighted centroid of the profile rows, then cosine scores for the catalog
+    selector = csr_matrix(
+        (weights[known], (np.zeros(known.sum(), dtype=np.int64), rows[known])),
+        shape=(1, tfidf_matrix.shape[0])
+    )
+    profile = selector @ tfidf_matrix
+    norm = np.sqrt(profile.multiply(profile).sum())
+    if norm == 0:
+        return []
+    scores = np.asarray((tfidf_matrix @ profile.T).todense()).ravel() / norm
+    
+    # Mask out the profile itself and ineligible recipes
+    scores[rows[known]] = 0
+    if allowed_ids is not None:
+        scores[~np.isin(row_ids, allowed_ids, assume_unique=True)] = 0
+    
+    # Top-K by score, ties broken by recipe id
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > top_n:
+        # Keep everything scoring at least the top_n-th best so ties at the cut sort by id
+        threshold = np.partition(scores[candidates], len(candidates) - top_n)[len(candidates) - top_n]
+        candidates = candidates[scores[candidates] >= threshold]
+    candidates = candidates[np.lexsort((row_ids[candidates], -scores[candidates]))][:top_n]
+    return list(zip(row_ids[candidates].tolist(), scores[candidates].tolist()))
 
 def search_by_ingredients(ingredient_query, limit=20, user=None):
     """
@@ -124,41 +262,9 @@ def search_by_ingredients(ingredient_query, limit=20, user=None):
     else:
         ingredients = [i.strip().lower() for i in ingredient_query.split(',')]
         
-        # Start with all recipes
-        all_recipes = Recipe.objects.all()
-        matching_recipe_ids = []
-        
-        # Filter for recipes that contain ALL the specified ingredients
-        for recipe in all_recipes:
-            recipe_ingredients = set([
-                ri.ingredient.name.lower() 
-                for ri in recipe.recipe_ingredients.all()
-            ])
-            
-            # Check if all search ingredients are in this recipe
-            # Using a more flexible matching logic that handles singular/plural forms
-            ingredient_match = True
-            for ingredient in ingredients:
-                # Check for exact match first
-                exact_match = any(ingredient in ingredient_name for ingredient_name in recipe_ingredients)
-                
-                # If no exact match, try checking for singular/plural forms
-                if not exact_match:
-                    # Check for singular form (remove trailing 's' if present)
-                    singular_form = ingredient[:-1] if ingredient.endswith('s') else ingredient
-                    singular_match = any(singular_form in ingredient_name for ingredient_name in recipe_ingredients)
-                    
-                    # Check for plural form (add 's' if not present)
-                    plural_form = ingredient if ingredient.endswith('s') else ingredient + 's'
-                    plural_match = any(plural_form in ingredient_name for ingredient_name in recipe_ingredients)
-                    
-                    # Consider a match if either singular or plural form matches
-                    if not (singular_match or plural_match):
-                        ingredient_match = False
-                        break
-                
-            if ingredient_match:
-                matching_recipe_ids.append(recipe.recipe_id)
+        # Intersect the index postings for every requested ingredient
+        # (substring matching, including singular/plural forms)
+        matching_recipe_ids = ingredient_index.recipes_with_all(ingredients).tolist()
         
         # Get recipes with the matching IDs
         recipes = Recipe.objects.filter(recipe_id__in=matching_recipe_ids)
@@ -174,12 +280,7 @@ def search_by_ingredients(ingredient_query, limit=20, user=None):
         
         if preferences:
             # Filter recipes for those matching all preferences
-            filtered_recipes = []
-            
-            for recipe in recipes:
-                if all(pref in recipe.dietary_tags for pref in preferences):
-                    filtered_recipes.append(recipe.recipe_id)
-            
+            filtered_recipes = dietary_index.recipe_ids_matching(preferences).tolist()
             recipes = recipes.filter(recipe_id__in=filtered_recipes)
     
     return recipes[:limit]
@@ -194,22 +295,22 @@ def find_almost_matching_recipes(ingredient_query, limit=10, max_missing=2, user
     
     user_ingredients = [i.strip().lower() for i in ingredient_query.split(',') if i.strip()]
     
+    # Cache key for this query (scoped to the user's cache version, since
+    # results depend on their dietary preferences)
+    cache_key = f'almost_matching_recipes:{",".join(sorted(user_ingredients))}:{max_missing}'
+    if user and user.is_authenticated:
+        from recommendations.recommendation_engine import user_cache_key
+        cache_key = user_cache_key(cache_key, user.id)
+    
     # Skip cache if force_refresh is True
     if not force_refresh:
-        # Cache key for this query
-        cache_key = f'almost_matching_recipes:{",".join(sorted(user_ingredients))}:{max_missing}'
-        if user and user.is_authenticated:
-            cache_key += f':{user.id}'
-        
         # Check cache first
         cached_result = cache.get(cache_key)
         if cached_result is not None:
             return cached_result
     
-    # Get all recipes
-    all_recipes = Recipe.objects.prefetch_related('recipe_ingredients__ingredient')
-    
-    # Filter by user dietary preferences if applicable
+    # Restrict to recipes matching the user's dietary preferences if applicable
+    allowed_ids = None
     if user and user.is_authenticated:
         from recommendations.models import DietaryPreference
         preferences = list(DietaryPreference.objects.filter(
@@ -217,94 +318,27 @@ def find_almost_matching_recipes(ingredient_query, limit=10, max_missing=2, user
         ).values_list('restriction_type', flat=True))
         
         if preferences:
-            filtered_recipes = []
-            for recipe in all_recipes:
-                if all(pref in recipe.dietary_tags for pref in preferences):
-                    filtered_recipes.append(recipe.recipe_id)
-            
-            all_recipes = all_recipes.filter(recipe_id__in=filtered_recipes)
-    
-    matched_recipes = []
-    
-    # For each recipe, calculate how many of user's ingredients it uses
-    # and how many additional ingredients are needed
-    for recipe in all_recipes:
-        recipe_ingredients = [ri.ingredient.name.lower() for ri in recipe.recipe_ingredients.all()]
-        
-        # Skip recipes with too many ingredients if user only entered a few
-        if len(recipe_ingredients) > len(user_ingredients) * 2:
-            continue
-            
-        # Count the ingredients that match and don't match
-        matching_ingredients = []
-        missing_ingredients = []
-        
-        for recipe_ingredient in recipe_ingredients:
-            found = False
-            matching_user_ingredient = None
-            
-            # Check for exact or partial matches with user ingredients
-            for user_ingredient in user_ingredients:
-                # Exact match
-                if recipe_ingredient == user_ingredient:
-                    found = True
-                    matching_user_ingredient = user_ingredient
-                    break
-                    
-                # Partial match (ingredient contains user ingredient or vice versa)
-                if user_ingredient in recipe_ingredient or recipe_ingredient in user_ingredient:
-                    found = True
-                    matching_user_ingredient = user_ingredient
-                    break
-                    
-                # Handle singular/plural variations
-                singular = user_ingredient[:-1] if user_ingredient.endswith('s') else user_ingredient
-                plural = user_ingredient if user_ingredient.endswith('s') else user_ingredient + 's'
-                
-                if singular in recipe_ingredient or recipe_ingredient in singular:
-                    found = True
-                    matching_user_ingredient = user_ingredient
-                    break
-                    
-                if plural in recipe_ingredient or recipe_ingredient in plural:
-                    found = True
-                    matching_user_ingredient = user_ingredient
-                    break
-            
-            if found:
-                matching_ingredients.append((recipe_ingredient, matching_user_ingredient))
-            else:
-                missing_ingredients.append(recipe_ingredient)
-        
-        # Calculate relevance metrics
-        match_ratio = len(matching_ingredients) / len(recipe_ingredients) if recipe_ingredients else 0
-        ingredient_utilization = len(matching_ingredients) / len(user_ingredients) if user_ingredients else 0
-        
-        # Recipe must use at least one of the user's ingredients
-        # And be missing no more than max_missing ingredients
-        if matching_ingredients and len(missing_ingredients) <= max_missing:
-            matched_recipes.append({
-                'recipe': recipe,
-                'missing_ingredients': missing_ingredients,
-                'matching_ingredients': [match[0] for match in matching_ingredients],
-                'missing_count': len(missing_ingredients),
-                'match_count': len(matching_ingredients),
-                'match_ratio': match_ratio,
-                'ingredient_utilization': ingredient_utilization,
-                # Score recipes higher when they use more of user's ingredients
-                # and have fewer missing ingredients
-                'relevance_score': (match_ratio * 3) + (ingredient_utilization * 2) - (0.1 * len(missing_ingredients))
-            })
-    
-    # Sort by our composite relevance score (higher is better)
-    matched_recipes.sort(key=lambda x: x['relevance_score'], reverse=True)
-    
-    # Return top matches up to requested limit
-    result = matched_recipes[:limit]
+            allowed_ids = dietary_index.recipe_ids_matching(preferences)
+    
+    # Match counts, missing counts and relevance scores for every recipe come
+    # from a single sparse mat-vec over the recipe x ingredient matrix
+    matched_recipes = ingredient_matrix.almost_matching(
+        user_ingredients, max_missing, limit, allowed_ids=allowed_ids
+    )
+    
+    recipes = Recipe.objects.prefetch_related('recipe_ingredients__ingredient').in_bulk(
+        [match['recipe_id'] for match in matched_recipes]
+    )
+    
+    # Already ranked and limited by the matrix
+    result = []
+    for match in matched_recipes:
+        recipe = recipes.get(match.pop('recipe_id'))
+        if recipe is not None:
+            result.append({'recipe': recipe, **match})
     
     # Cache the result for a short time only
     if not force_refresh and user and user.is_authenticated:
-        cache_key = f'almost_matching_recipes:{",".join(sorted(user_ingredients))}:{max_missing}:{user.id}'
         cache.set(cache_key, result, 60 * 5)  # Cache for 5 minutes
     
     return result